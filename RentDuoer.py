@@ -2,80 +2,1181 @@ import nextcord
 from nextcord.ext import commands, tasks
 from datetime import datetime, timedelta
 import asyncio
-from db_connection import get_database_connection, close_database_connection
+import contextlib
+import functools
+import heapq
+import itertools
+import re
+import socket
+import time
+import weakref
+from collections import OrderedDict
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+from db_connection import init_database, get_database, close_database
 from dotenv import load_dotenv
 import os
 import pymongo
-from pymongo.errors import PyMongoError
-from threading import Thread
-from flask import Flask
+from bson import ObjectId
+from pymongo.collation import Collation
+from pymongo.errors import BulkWriteError, ConnectionFailure, DuplicateKeyError, PyMongoError
+
+import metrics
+import outbound
+from health_server import HealthServer
+from tracing import tracer, traced, stage, detached
+
+# Process start, the origin of the startup phase timings
+STARTED_AT = time.perf_counter()
 
 load_dotenv()
 TOKEN = os.getenv('TOKEN')
-mongoURI = os.getenv('mongo_URI')
+mongoURI = os.getenv('mongoURI')
+
+# Shared, pooled database handle used by every callback
+database = init_database(mongoURI)
+
+# Player profile cache settings
+PLAYER_CACHE_SIZE = int(os.getenv('PLAYER_CACHE_SIZE', 1024))
+PLAYER_CACHE_TTL_SECONDS = int(os.getenv('PLAYER_CACHE_TTL_SECONDS', 300))
+
+# How long a guild's settings are cached before being re-read; /config refreshes the local copy at once
+GUILD_SETTINGS_TTL_SECONDS = int(os.getenv('GUILD_SETTINGS_TTL_SECONDS', 60))
+
+# Player names are matched case-insensitively, backed by an index with the same collation
+PLAYER_NAME_COLLATION = Collation(locale='en', strength=2)
+
+# Statuses of rentals that count towards stats and leaderboards
+FINISHED_STATUSES = ['Completed', 'Ended Early']
+
+# Statuses that hold a player's time slot
+BOOKED_STATUSES = ['Pending', 'Accepted']
+
+# Statuses a rental never leaves; these are archived once old enough
+TERMINAL_STATUSES = FINISHED_STATUSES + ['Declined', 'Expired']
+
+# Finished rentals older than this many days move from Rentals to RentalsArchive
+RENTAL_ARCHIVE_AFTER_DAYS = int(os.getenv('RENTAL_ARCHIVE_AFTER_DAYS', 30))
+RENTAL_ARCHIVE_BATCH_SIZE = int(os.getenv('RENTAL_ARCHIVE_BATCH_SIZE', 500))
+
+# Pending bookings nobody answered this long after their requested start are expired
+PENDING_EXPIRY_MINUTES = int(os.getenv('PENDING_EXPIRY_MINUTES', 60))
+
+# How often the archive and expiry job runs
+LIFECYCLE_INTERVAL_MINUTES = int(os.getenv('LIFECYCLE_INTERVAL_MINUTES', 15))
+
+# Claimed and expired requests are deleted by a TTL index this long after their end time
+REQUEST_RETENTION_DAYS = 30
+
+# Discord only accepts a response to an interaction for 15 minutes, so older ids are never redelivered
+INTERACTION_DEDUPE_SECONDS = 15 * 60
+
+# Number of players shown per page of /players results
+PLAYER_SEARCH_PAGE_SIZE = 5
+
+# Number of best-matching available players DMed about each booking request
+REQUEST_MATCH_LIMIT = int(os.getenv('REQUEST_MATCH_LIMIT', 5))
+
+# Minutes before a scheduled rental starts to ping the boss and player
+REMINDER_MINUTES = int(os.getenv('RENTAL_REMINDER_MINUTES', 15))
+
+# How often countdown messages are edited; 0 relies on Discord timestamps alone
+CLOCK_REFRESH_SECONDS = int(os.getenv('RENTAL_CLOCK_REFRESH_SECONDS', 60))
+
+# Sharded mode: total shard count and the shards this worker connects (e.g. "0,1"); unset runs one unsharded bot
+SHARD_COUNT = int(os.getenv('SHARD_COUNT', 0))
+SHARD_IDS = [int(shard_id) for shard_id in os.getenv('SHARD_IDS', '').split(',') if shard_id.strip()] or None
+
+# Identity of this process in rental leases; must differ between concurrently running workers
+WORKER_ID = os.getenv('WORKER_ID') or f"{socket.gethostname()}:{os.getpid()}"
+
+# A worker runs its rentals' timers while its lease is fresh; a crashed worker's rentals are taken over once it expires
+RENTAL_LEASE_SECONDS = int(os.getenv('RENTAL_LEASE_SECONDS', 15))
+
+# Longest wait between startup retries while the database is unreachable
+STARTUP_RETRY_MAX_SECONDS = 60
+
+# A player's booking lock lapses this long after a crashed worker took it; a busy lock is
+# waited on for at most BOOKING_LOCK_WAIT_SECONDS so the interaction can still be answered
+BOOKING_LOCK_SECONDS = 10
+BOOKING_LOCK_WAIT_SECONDS = 2
 
 # Bot setup
 intents = nextcord.Intents.default()
 intents.message_content = True
 intents.members = True
-bot = commands.Bot(command_prefix='/', intents=intents)
+if SHARD_COUNT:
+    bot = commands.AutoShardedBot(command_prefix='/', intents=intents, shard_count=SHARD_COUNT, shard_ids=SHARD_IDS)
+else:
+    bot = commands.Bot(command_prefix='/', intents=intents)
+
+def tokenize_games(games):
+    """Split the free-text games field into normalized search tags."""
+    tags = []
+    for game in re.split(r'[,;/\n]+', games):
+        tag = ' '.join(game.split()).casefold()
+        if tag and tag not in tags:
+            tags.append(tag)
+    return tags
+
+def player_search_fields(city, games):
+    return {'CityKey': city.strip().casefold(), 'GameTags': tokenize_games(games)}
+
+async def backfill_player_search_fields(db):
+    # Players registered before search existed lack the normalized fields
+    requests = [
+        pymongo.UpdateOne({'_id': player['_id']}, {'$set': player_search_fields(player.get('City', ''), player.get('Games', ''))})
+        for player in await db.Players.find({'GameTags': {'$exists': False}}, {'City': 1, 'Games': 1})
+    ]
+    if requests:
+        await db.Players.bulk_write(requests, ordered=False)
+
+# Rollup GuildID for rentals stored before GuildID was recorded; $merge cannot match on a missing field
+NO_GUILD_ID = 0
+
+def rental_stats_pipeline(role, id_field):
+    """Aggregate finished rentals, archived ones included, into daily RentalStats rollups for one role."""
+    match = {'$match': {'Status': {'$in': FINISHED_STATUSES}, 'ActualEndTime': {'$exists': True}}}
+    return [
+        match,
+        {'$unionWith': {'coll': 'RentalsArchive', 'pipeline': [match]}},
+        {'$group': {
+            '_id': {'Day': {'$dateTrunc': {'date': '$ActualEndTime', 'unit': 'day'}},
+                    'GuildID': {'$ifNull': ['$GuildID', NO_GUILD_ID]}, 'UserID': f'${id_field}'},
+            'Hours': {'$sum': '$ActualDuration'},
+            'Revenue': {'$sum': '$TotalPrice'},
+            'Rentals': {'$sum': 1}
+        }},
+        {'$project': {'_id': 0, 'Role': role, 'Day': '$_id.Day', 'GuildID': '$_id.GuildID', 'UserID': '$_id.UserID',
+                      'Hours': 1, 'Revenue': 1, 'Rentals': 1}},
+        {'$merge': {'into': 'RentalStats', 'on': ['Role', 'Day', 'GuildID', 'UserID'],
+                    'whenMatched': 'replace', 'whenNotMatched': 'insert'}}
+    ]
+
+async def rebuild_rental_stats(db):
+    # Recompute every daily rollup from the Rentals history
+    await asyncio.gather(
+        db.Rentals.aggregate(rental_stats_pipeline('Player', 'PlayerID')),
+        db.Rentals.aggregate(rental_stats_pipeline('Boss', 'BossID'))
+    )
+
+# Bump whenever setup_mongodb gains a collection, index or backfill so warm restarts apply it
+SCHEMA_VERSION = 9
+
+# First schema version whose RentalStats rollups are keyed by guild
+GUILD_RENTAL_STATS_VERSION = 6
+
+# Only live rentals are indexed for booking lookups; history is served by the ActualEndTime indexes
+LIVE_RENTALS = {'Status': {'$in': BOOKED_STATUSES}}
+FINISHED_RENTALS = {'ActualEndTime': {'$exists': True}}
+
+# Indexes per collection, as (keys, options) pairs for create_index
+INDEXES = {
+    'Boss': [
+        ('BossID', {'unique': True}),
+    ],
+    'Players': [
+        ('PlayerID', {'unique': True}),
+        ('PlayerName', {'collation': PLAYER_NAME_COLLATION}),
+        ([('GameTags', 1), ('CityKey', 1), ('PricePerHour', 1), ('_id', 1)], {}),
+        ([('CityKey', 1), ('PricePerHour', 1), ('_id', 1)], {}),
+        ([('Talent', 'text'), ('Games', 'text')], {}),
+        ([('GameTags', 1), ('PricePerHour', 1), ('_id', 1)], {}),
+        ([('PricePerHour', 1), ('_id', 1)], {}),
+    ],
+    'Rentals': [
+        ([('BossID', 1), ('PlayerID', 1), ('RequestedStartTime', 1)], {'name': 'live_boss_player_start_unique', 'unique': True, 'partialFilterExpression': LIVE_RENTALS}),
+        ([('Status', 1), ('RequestedStartTime', 1)], {'name': 'live_status_start', 'partialFilterExpression': LIVE_RENTALS}),
+        ([('PlayerID', 1), ('Status', 1), ('RequestedStartTime', 1)], {'name': 'live_player_status_start', 'partialFilterExpression': LIVE_RENTALS}),
+        ([('Status', 1), ('LeaseOwner', 1)], {'name': 'live_status_owner', 'partialFilterExpression': LIVE_RENTALS}),
+        ([('Status', 1), ('RequestedEndTime', 1)], {}),
+        ([('PlayerID', 1), ('ActualEndTime', 1)], {'partialFilterExpression': FINISHED_RENTALS}),
+        ([('BossID', 1), ('ActualEndTime', 1)], {'partialFilterExpression': FINISHED_RENTALS}),
+    ],
+    'RentalsArchive': [
+        ([('PlayerID', 1), ('ActualEndTime', 1)], {'partialFilterExpression': FINISHED_RENTALS}),
+        ([('BossID', 1), ('ActualEndTime', 1)], {'partialFilterExpression': FINISHED_RENTALS}),
+    ],
+    'RentalStats': [
+        ([('Role', 1), ('Day', 1), ('GuildID', 1), ('UserID', 1)], {'unique': True}),
+    ],
+    'Requests': [
+        ([('Status', 1), ('RequestedEndTime', 1)], {}),
+        ('RequestedEndTime', {'expireAfterSeconds': REQUEST_RETENTION_DAYS * 86400}),
+    ],
+    'ProcessedInteractions': [
+        ('CreatedAt', {'expireAfterSeconds': INTERACTION_DEDUPE_SECONDS}),
+    ],
+    'BookingLocks': [
+        ('ExpiresAt', {'expireAfterSeconds': 0}),
+    ],
+    'Workers': [
+        ('LeaseExpiresAt', {'expireAfterSeconds': 0}),
+    ],
+}
+
+# Indexes replaced by the ones above; dropped before the new ones are built
+OBSOLETE_INDEXES = {
+    'Players': [
+        'GameTags_1_CityKey_1_PricePerHour_1',
+        'CityKey_1_PricePerHour_1',
+        'GameTags_1_PricePerHour_1',
+    ],
+    'Rentals': [
+        'BossID_1_PlayerID_1_RequestedStartTime_1',
+        'Status_1_ActualStartTime_1',
+        'PlayerID_1_Status_1_RequestedStartTime_1',
+        'Status_1_LeaseExpiresAt_1',
+        'live_boss_player_start',
+        'live_status_lease',
+    ],
+    'RentalStats': [
+        'Role_1_Day_1_UserID_1',
+    ],
+}
+
+async def drop_obsolete_indexes(db, name, index_names):
+    existing = {index['name'] for index in await db[name].list_indexes()}
+    await asyncio.gather(*(db[name].drop_index(index) for index in index_names if index in existing))
+
+async def expire_duplicate_bookings(db):
+    """Expire all but one live rental per boss, player and start time so the unique index can be built.
+
+    Accepted rentals are kept over pending ones, then the oldest.
+    """
+    duplicates = await db.Rentals.aggregate([
+        {'$match': LIVE_RENTALS},
+        {'$sort': {'Status': 1, '_id': 1}},
+        {'$group': {
+            '_id': {'BossID': '$BossID', 'PlayerID': '$PlayerID', 'RequestedStartTime': '$RequestedStartTime'},
+            'ids': {'$push': '$_id'}
+        }},
+        {'$match': {'ids.1': {'$exists': True}}}
+    ])
+    extra = [rental_id for group in duplicates for rental_id in group['ids'][1:]]
+    if extra:
+        await db.Rentals.update_many({'_id': {'$in': extra}}, {'$set': {'Status': 'Expired', 'ExpiredAt': datetime.now()}})
+        print(f"Expired {len(extra)} duplicate live rentals")
+
+async def setup_mongodb(db=None):
+    """Create collections and indexes and run backfills, unless this schema version was already applied.
+
+    The applied version is kept in the ``Meta`` collection, so warm restarts
+    cost a single read. Returns ``True`` if any setup work ran.
+    """
+    db = db or get_database()
+    schema, existing = await asyncio.gather(
+        db.Meta.find_one({'_id': 'schema'}),
+        db.list_collection_names()
+    )
+    if schema and schema.get('Version', 0) >= SCHEMA_VERSION:
+        return False
 
-def setup_mongodb():
-    db = get_database_connection()
-    
     # Create collections if they don't exist
-    if 'Boss' not in db.list_collection_names():
-        db.create_collection('Boss')
-    
-    if 'Players' not in db.list_collection_names():
-        db.create_collection('Players')
-    
-    if 'Rentals' not in db.list_collection_names():
-        db.create_collection('Rentals')
+    # Rollups written before they were keyed by guild are rebuilt from the rental history
+    rebuild_stats = schema is not None and schema.get('Version', 0) < GUILD_RENTAL_STATS_VERSION
+    build_rental_stats = 'RentalStats' not in existing or rebuild_stats
+    await asyncio.gather(*(db.create_collection(name) for name in INDEXES if name not in existing))
+    await asyncio.gather(*(drop_obsolete_indexes(db, name, names) for name, names in OBSOLETE_INDEXES.items()))
+    await expire_duplicate_bookings(db)
+
+    # Index builds on different collections run in parallel on the database pool
+    await asyncio.gather(*(
+        db[name].create_index(keys, **options)
+        for name, indexes in INDEXES.items()
+        for keys, options in indexes
+    ))
+
+    # Rentals booked before conflict detection have no stored end time
+    await asyncio.gather(
+        db.Rentals.update_many(
+            {'RequestedEndTime': {'$exists': False}},
+            [{'$set': {'RequestedEndTime': {'$add': ['$RequestedStartTime', {'$multiply': ['$RequestedDuration', 3600 * 1000]}]}}}]
+        ),
+        backfill_player_search_fields(db)
+    )
+    if rebuild_stats:
+        await db.RentalStats.delete_many({})
+    if build_rental_stats and await db.Rentals.estimated_document_count():
+        await rebuild_rental_stats(db)
+
+    await db.Meta.update_one(
+        {'_id': 'schema'},
+        {'$set': {'Version': SCHEMA_VERSION, 'AppliedAt': datetime.now()}},
+        upsert=True
+    )
+    return True
+
+class MemberIndex:
+    """Per-guild lookup of case-folded username/display name to member id.
+
+    Built once per guild when the bot connects and kept current from member
+    events, so resolving a name is a dict lookup instead of a member scan.
+    """
+
+    def __init__(self):
+        self.guilds = {}
+        self.member_keys = {}
+
+    @staticmethod
+    def normalize(name):
+        return name.strip().casefold()
+
+    def add(self, member):
+        self.remove(member)
+        index = self.guilds.setdefault(member.guild.id, {})
+        keys = {self.normalize(member.name), self.normalize(member.display_name)}
+        for key in keys:
+            index[key] = member.id
+        self.member_keys[(member.guild.id, member.id)] = keys
 
-    # Create indexes
-    db.Boss.create_index('BossID', unique=True)
-    db.Players.create_index('PlayerID', unique=True)
-    db.Rentals.create_index([('BossID', 1), ('PlayerID', 1), ('RequestedStartTime', 1)])
+    def remove(self, member):
+        keys = self.member_keys.pop((member.guild.id, member.id), set())
+        index = self.guilds.get(member.guild.id, {})
+        for key in keys:
+            if index.get(key) == member.id:
+                del index[key]
 
-# Call this function when your bot starts
-setup_mongodb()
+    def build(self, guild):
+        for member in guild.members:
+            self.add(member)
+
+    async def resolve(self, guild, name):
+        member_id = self.guilds.get(guild.id, {}).get(self.normalize(name))
+        if member_id:
+            member = guild.get_member(member_id)
+            if member:
+                return member
+
+        # Fall back to the gateway for members that are not cached yet
+        try:
+            candidates = await guild.query_members(query=name.strip(), limit=5)
+        except (asyncio.TimeoutError, nextcord.errors.ClientException) as e:
+            print(f"Error querying members: {e}")
+            return None
+
+        for member in candidates:
+            if self.normalize(name) in (self.normalize(member.name), self.normalize(member.display_name)):
+                self.add(member)
+                return member
+        return None
+
+member_index = MemberIndex()
+
+# Rate-budgeted queue for every bot-initiated channel message and edit
+outbox = outbound.Outbox()
+
+# Settings of guilds that have not run /config
+DEFAULT_GUILD_SETTINGS = {
+    'CustomerRoleID': None,
+    'PlayerRoleID': None,
+    'BookingChannelID': None,
+    'Currency': 'VND',
+    'Timezone': None,
+}
+
+# Role allowed to submit requests in guilds without a configured customer role
+DEFAULT_CUSTOMER_ROLE_NAME = "Customer"
+
+class GuildSettingsCache:
+    """Per-guild settings from the GuildSettings collection, cached for ``ttl`` seconds.
+
+    Role and channel settings are stored as ids, so permission checks are id
+    lookups on the member rather than scans of the guild's roles. Other
+    workers see a /config change once their cached copy expires.
+
+    Responses that must be a modal cannot wait on the database, so they use
+    :meth:`peek`; settings are loaded ahead of time with :meth:`prefetch`
+    when the bot connects or joins a guild.
+    """
+
+    def __init__(self, ttl=GUILD_SETTINGS_TTL_SECONDS):
+        self.ttl = ttl
+        self._entries = {}
+        self._refreshing = {}
+
+    @staticmethod
+    def resolve(guild, document):
+        settings = {key: document.get(key, default) for key, default in DEFAULT_GUILD_SETTINGS.items()}
+        if settings['CustomerRoleID'] is None:
+            # Resolve the legacy role name once per refresh instead of on every click
+            role = nextcord.utils.get(guild.roles, name=DEFAULT_CUSTOMER_ROLE_NAME)
+            settings['CustomerRoleID'] = role.id if role else None
+        return settings
+
+    async def get(self, guild):
+        if guild is None:
+            return dict(DEFAULT_GUILD_SETTINGS)
+
+        entry = self._entries.get(guild.id)
+        now = time.monotonic()
+        if entry is not None and entry[0] > now:
+            return entry[1]
+
+        db = get_database()
+        settings = self.resolve(guild, await db.GuildSettings.find_one({'_id': guild.id}) or {})
+        self._entries[guild.id] = (now + self.ttl, settings)
+        return settings
+
+    def peek(self, guild):
+        """Cached settings without waiting on the database.
+
+        An expired entry is returned as is and refreshed in the background; a
+        guild never loaded gets the defaults until its refresh completes.
+        """
+        if guild is None:
+            return dict(DEFAULT_GUILD_SETTINGS)
+        entry = self._entries.get(guild.id)
+        if entry is None or entry[0] <= time.monotonic():
+            self.prefetch(guild)
+        return entry[1] if entry is not None else self.resolve(guild, {})
+
+    def prefetch(self, guild):
+        """Load ``guild``'s settings in the background unless a load is already running."""
+        if guild.id not in self._refreshing:
+            self._refreshing[guild.id] = detached(asyncio.create_task, self._refresh(guild))
+
+    async def _refresh(self, guild):
+        try:
+            await self.load([guild])
+        finally:
+            del self._refreshing[guild.id]
+
+    async def load(self, guilds):
+        """Load the settings of every guild in ``guilds`` with one query."""
+        guilds = {guild.id: guild for guild in guilds}
+        if not guilds:
+            return
+        db = get_database()
+        try:
+            documents = await db.GuildSettings.find({'_id': {'$in': list(guilds)}})
+        except PyMongoError as err:
+            print(f"A database error occurred while loading guild settings: {err}")
+            return
+        documents = {document['_id']: document for document in documents}
+        expires_at = time.monotonic() + self.ttl
+        for guild_id, guild in guilds.items():
+            self._entries[guild_id] = (expires_at, self.resolve(guild, documents.get(guild_id, {})))
+
+    async def update(self, guild, **changes):
+        db = get_database()
+        await db.GuildSettings.update_one({'_id': guild.id}, {'$set': changes}, upsert=True)
+        self.invalidate(guild.id)
+        return await self.get(guild)
+
+    def invalidate(self, guild_id):
+        self._entries.pop(guild_id, None)
+
+guild_settings = GuildSettingsCache()
+
+def has_role(member, role_id):
+    return role_id is not None and member.get_role(role_id) is not None
+
+def booking_channel(settings, interaction):
+    """Channel where booking notices for this interaction's guild are posted."""
+    channel_id = settings['BookingChannelID']
+    return (bot.get_channel(channel_id) if channel_id else None) or interaction.channel
+
+def format_price(amount, currency):
+    return f"{amount // 1000}K {currency}"
+
+def parse_local_time(text, timezone=None):
+    """Parse DD/MM/YYYY HH:MM entered in the guild's timezone into the bot's local time."""
+    parsed = datetime.strptime(text, "%d/%m/%Y %H:%M")
+    if timezone:
+        parsed = parsed.replace(tzinfo=ZoneInfo(timezone)).astimezone().replace(tzinfo=None)
+    return parsed
+
+def to_guild_time(value, timezone=None):
+    """Convert a bot-local time to the guild's timezone for display."""
+    if timezone:
+        return value.astimezone(ZoneInfo(timezone)).replace(tzinfo=None)
+    return value
+
+class PlayerCache:
+    """LRU cache of player profiles with a TTL, keyed by PlayerID and name.
+
+    Bookings for popular players are answered from memory; RegisterModal
+    writes through with :meth:`put` so cached profiles never go stale.
+    """
+
+    def __init__(self, max_size=PLAYER_CACHE_SIZE, ttl=PLAYER_CACHE_TTL_SECONDS):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.names = {}
+
+    @staticmethod
+    def normalize(name):
+        return name.strip().casefold()
+
+    def get_by_id(self, player_id):
+        entry = self.entries.get(player_id)
+        if entry is None:
+            return None
+        expires_at, player = entry
+        if expires_at < time.monotonic():
+            self.invalidate(player_id)
+            return None
+        self.entries.move_to_end(player_id)
+        return player
+
+    def get_by_name(self, name):
+        player_id = self.names.get(self.normalize(name))
+        return self.get_by_id(player_id) if player_id else None
+
+    def put(self, player):
+        player_id = player['PlayerID']
+        self.invalidate(player_id)
+        self.entries[player_id] = (time.monotonic() + self.ttl, player)
+        self.names[self.normalize(player['PlayerName'])] = player_id
+        while len(self.entries) > self.max_size:
+            self.invalidate(next(iter(self.entries)))
+
+    def invalidate(self, player_id):
+        entry = self.entries.pop(player_id, None)
+        if entry:
+            name = self.normalize(entry[1]['PlayerName'])
+            if self.names.get(name) == player_id:
+                del self.names[name]
+
+    async def find_by_name(self, name):
+        player = self.get_by_name(name)
+        if player is None:
+            db = get_database()
+            player = await db.Players.find_one({'PlayerName': name.strip()}, collation=PLAYER_NAME_COLLATION)
+            if player:
+                self.put(player)
+        return player
+
+player_cache = PlayerCache()
+
+class InteractionDedupe:
+    """Remembers handled interaction ids so a redelivered interaction is processed once.
+
+    Ids seen by this process are answered from memory, before the handler
+    responds. The first sighting is also recorded in ``ProcessedInteractions``
+    (unique ``_id``, TTL on ``CreatedAt``) in the background; handlers
+    :meth:`confirm` that insert before their first write, so another worker
+    receiving the same interaction loses it and skips the write too. The
+    insert never delays the initial defer or modal.
+    """
+
+    def __init__(self, ttl=INTERACTION_DEDUPE_SECONDS):
+        self.ttl = ttl
+        self.seen = OrderedDict()
+        self._inserts = {}
+
+    def _expire(self, now):
+        while self.seen and next(iter(self.seen.values())) < now:
+            self.seen.popitem(last=False)
+
+    def first_seen(self, interaction_id):
+        """Return ``True`` the first time this process sees ``interaction_id`` and start recording it."""
+        now = time.monotonic()
+        self._expire(now)
+        if interaction_id in self.seen:
+            return False
+        self.seen[interaction_id] = now + self.ttl
+        self._inserts[interaction_id] = asyncio.create_task(self._record(interaction_id))
+        return True
+
+    async def _record(self, interaction_id):
+        db = get_database()
+        try:
+            await db.ProcessedInteractions.insert_one({'_id': interaction_id, 'CreatedAt': datetime.now()})
+        except DuplicateKeyError:
+            return False
+        except PyMongoError as err:
+            # Handlers guard their own writes, so fail open rather than drop the interaction
+            print(f"A database error occurred while recording interaction {interaction_id}: {err}")
+        return True
+
+    async def confirm(self, interaction_id):
+        """Wait for the id to be recorded; ``False`` if another worker recorded it first."""
+        insert = self._inserts.pop(interaction_id, None)
+        if insert is None or await insert:
+            return True
+        metrics.DUPLICATES_SUPPRESSED.inc(kind='interaction')
+        return False
+
+    def forget(self, interaction_id):
+        # Handlers that returned before confirming leave the insert to finish on its own
+        self._inserts.pop(interaction_id, None)
+
+interaction_dedupe = InteractionDedupe()
+
+def once_per_interaction(func):
+    """Decorator skipping a callback for an interaction this process already handled.
+
+    The decorated handler must ``await interaction_dedupe.confirm(interaction.id)``
+    before its first write and stop if it returns ``False``.
+    """
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        # Callbacks take the interaction as their last argument
+        interaction = args[-1]
+        if not interaction_dedupe.first_seen(interaction.id):
+            metrics.DUPLICATES_SUPPRESSED.inc(kind='interaction')
+            return
+        try:
+            return await func(*args, **kwargs)
+        finally:
+            interaction_dedupe.forget(interaction.id)
+    return wrapper
+
+# Boss names last written to the Boss collection, to skip upserts that would change nothing
+known_bosses = OrderedDict()
+
+async def upsert_boss(boss_id, boss_name):
+    if known_bosses.get(boss_id) == boss_name:
+        known_bosses.move_to_end(boss_id)
+        return
+    db = get_database()
+    await db.write_buffer.submit('Boss', pymongo.UpdateOne(
+        {'BossID': boss_id},
+        {'$set': {'BossName': boss_name}},
+        upsert=True
+    ))
+    known_bosses[boss_id] = boss_name
+    if len(known_bosses) > PLAYER_CACHE_SIZE:
+        known_bosses.popitem(last=False)
+
+def rental_lease():
+    """Fields putting a rental's timers under this worker's lease."""
+    return {'LeaseOwner': WORKER_ID}
+
+async def live_workers(now):
+    """Ids of the workers whose lease in ``Workers`` has not expired at ``now``."""
+    db = get_database()
+    workers = await db.Workers.find({'LeaseExpiresAt': {'$gt': now}}, {'_id': 1})
+    return {worker['_id'] for worker in workers}
+
+async def find_conflicting_rental(player_id, start_time, end_time, statuses=BOOKED_STATUSES):
+    """Return a rental of the player in one of ``statuses`` overlapping [start_time, end_time), if any."""
+    db = get_database()
+    return await db.Rentals.find_one(
+        {
+            'PlayerID': player_id,
+            'Status': {'$in': statuses},
+            'RequestedStartTime': {'$lt': end_time},
+            'RequestedEndTime': {'$gt': start_time}
+        },
+        {'_id': 1}
+    )
+
+@contextlib.asynccontextmanager
+async def player_booking_lock(player_id):
+    """Hold ``player_id``'s booking lock across all workers; yields ``False`` if it stayed busy.
+
+    Accepting or claiming a booking checks for an overlapping accepted rental
+    and then writes; holding this lock around both keeps two workers (or two
+    clicks) from booking the player twice. The lock is a ``BookingLocks``
+    document that expires, so one left by a crashed worker lapses.
+    """
+    db = get_database()
+    token = ObjectId()
+    async with bot.rental_timer.lock(('player', player_id)):
+        deadline = time.monotonic() + BOOKING_LOCK_WAIT_SECONDS
+        while True:
+            now = datetime.now()
+            try:
+                # Matches only a free or expired lock; otherwise the upsert collides on _id
+                await db.BookingLocks.update_one(
+                    {'_id': player_id, 'ExpiresAt': {'$not': {'$gt': now}}},
+                    {'$set': {'Token': token, 'ExpiresAt': now + timedelta(seconds=BOOKING_LOCK_SECONDS)}},
+                    upsert=True
+                )
+                break
+            except DuplicateKeyError:
+                if time.monotonic() >= deadline:
+                    yield False
+                    return
+                await asyncio.sleep(0.1)
+        try:
+            yield True
+        finally:
+            await db.BookingLocks.delete_one({'_id': player_id, 'Token': token})
+
+async def record_rental_stats(entries):
+    """Add finished rentals to the daily RentalStats rollups of their player and boss.
+
+    ``entries`` are ``(end_time, guild_id, boss_id, player_id, hours, revenue)`` tuples.
+    """
+    requests = []
+    for end_time, guild_id, boss_id, player_id, hours, revenue in entries:
+        day = end_time.replace(hour=0, minute=0, second=0, microsecond=0)
+        guild_id = NO_GUILD_ID if guild_id is None else guild_id
+        for role, user_id in (('Player', player_id), ('Boss', boss_id)):
+            requests.append(pymongo.UpdateOne(
+                {'Role': role, 'Day': day, 'GuildID': guild_id, 'UserID': user_id},
+                {'$inc': {'Hours': hours, 'Revenue': revenue, 'Rentals': 1}},
+                upsert=True
+            ))
+    if requests:
+        # Rollups of rentals finishing together go out in one buffered bulk write
+        db = get_database()
+        await asyncio.gather(*(db.write_buffer.submit('RentalStats', request) for request in requests))
+
+def merge_intervals(intervals):
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return merged
+
+async def find_free_slots(player_id, window_start, window_end):
+    """Compute a player's free slots in a window from a single range query."""
+    db = get_database()
+    rentals = await db.Rentals.find(
+        {
+            'PlayerID': player_id,
+            'Status': {'$in': BOOKED_STATUSES},
+            'RequestedStartTime': {'$lt': window_end},
+            'RequestedEndTime': {'$gt': window_start}
+        },
+        {'RequestedStartTime': 1, 'RequestedEndTime': 1}
+    )
+    busy = merge_intervals((max(r['RequestedStartTime'], window_start), min(r['RequestedEndTime'], window_end)) for r in rentals)
+
+    free = []
+    cursor = window_start
+    for start, end in busy:
+        if start > cursor:
+            free.append((cursor, start))
+        cursor = max(cursor, end)
+    if cursor < window_end:
+        free.append((cursor, window_end))
+    return free
+
+async def find_matching_players(game, max_price, start_time, end_time, limit=REQUEST_MATCH_LIMIT, exclude=()):
+    """Return up to ``limit`` of the cheapest players who play ``game`` within budget and are free for the window."""
+    db = get_database()
+    # Over-fetch so players who turn out to be booked can be skipped without a second query
+    candidates = await db.Players.find(
+        {'GameTags': game, 'PricePerHour': {'$lte': max_price}, 'PlayerID': {'$nin': list(exclude)}},
+        {'_id': 0, 'PlayerID': 1, 'PlayerName': 1, 'PricePerHour': 1},
+        sort=[('PricePerHour', 1)],
+        limit=limit * 4
+    )
+    if not candidates:
+        return []
+
+    busy = await db.Rentals.distinct('PlayerID', {
+        'PlayerID': {'$in': [player['PlayerID'] for player in candidates]},
+        'Status': {'$in': BOOKED_STATUSES},
+        'RequestedStartTime': {'$lt': end_time},
+        'RequestedEndTime': {'$gt': start_time}
+    })
+    busy = set(busy)
+    return [player for player in candidates if player['PlayerID'] not in busy][:limit]
+
+async def expire_stale_bookings(now):
+    """Expire pending bookings nobody answered and open requests whose time window has passed."""
+    db = get_database()
+    rentals, requests = await asyncio.gather(
+        db.Rentals.update_many(
+            {'Status': 'Pending', 'RequestedStartTime': {'$lt': now - timedelta(minutes=PENDING_EXPIRY_MINUTES)}},
+            {'$set': {'Status': 'Expired', 'ExpiredAt': now}}
+        ),
+        db.Requests.update_many(
+            {'Status': 'Open', 'RequestedEndTime': {'$lte': now}},
+            {'$set': {'Status': 'Expired', 'ExpiredAt': now}}
+        )
+    )
+    return rentals.modified_count, requests.modified_count
+
+async def archive_finished_rentals(cutoff, batch_size=RENTAL_ARCHIVE_BATCH_SIZE):
+    """Move finished rentals that ended before ``cutoff`` to RentalsArchive, one batch at a time.
+
+    Each batch is copied before it is deleted, so an interrupted run leaves
+    duplicates in the archive rather than losing rentals; the next run skips
+    the copies that already exist.
+    """
+    db = get_database()
+    query = {'Status': {'$in': TERMINAL_STATUSES}, 'RequestedEndTime': {'$lt': cutoff}}
+    archived = 0
+    while True:
+        batch = await db.Rentals.find(query, sort=[('RequestedEndTime', 1)], limit=batch_size)
+        if not batch:
+            break
+        try:
+            await db.RentalsArchive.insert_many(batch, ordered=False)
+        except BulkWriteError as e:
+            if any(error['code'] != 11000 for error in e.details.get('writeErrors', [])):
+                raise
+        result = await db.Rentals.delete_many({'_id': {'$in': [rental['_id'] for rental in batch]}, 'Status': {'$in': TERMINAL_STATUSES}})
+        archived += result.deleted_count
+        metrics.RENTALS_ARCHIVED.inc(result.deleted_count)
+        if len(batch) < batch_size:
+            break
+    return archived
+
+@tasks.loop(minutes=LIFECYCLE_INTERVAL_MINUTES)
+async def rental_lifecycle():
+    # Safe on every worker at once: each step only acts on documents still in the matching state
+    now = datetime.now()
+    try:
+        expired_rentals, expired_requests = await expire_stale_bookings(now)
+        archived = await archive_finished_rentals(now - timedelta(days=RENTAL_ARCHIVE_AFTER_DAYS))
+    except PyMongoError as err:
+        print(f"A database error occurred during rental lifecycle: {err}")
+        return
+
+    metrics.BOOKINGS_EXPIRED.inc(expired_rentals, kind='rental')
+    metrics.BOOKINGS_EXPIRED.inc(expired_requests, kind='request')
+    if expired_rentals or expired_requests or archived:
+        print(f"Expired {expired_rentals} pending rentals and {expired_requests} requests, archived {archived} rentals")
 
 # Slash command
 @bot.slash_command(name="hi", description="Show booking and register options")
+@traced('hi')
 async def hi(interaction: nextcord.Interaction):
     try:
-        await interaction.response.defer()
+        with stage('defer'):
+            await interaction.response.defer()
     except nextcord.errors.NotFound:
         # Interaction has already been responded to or timed out
         return
 
     try:
         view = MainView()
-        await interaction.followup.send("Choose an option:", view=view)
+        with stage('send'):
+            await interaction.followup.send("Choose an option:", view=view)
     except nextcord.errors.HTTPException as e:
         print(f"Error sending followup: {e}")
 
+@bot.slash_command(name="players", description="Search registered players")
+async def players(
+    interaction: nextcord.Interaction,
+    game: str = nextcord.SlashOption(description="Game the player can play", required=False),
+    city: str = nextcord.SlashOption(description="Player's city", required=False),
+    show_cam: str = nextcord.SlashOption(description="Show cam", choices=["yes", "no"], required=False),
+    min_price: float = nextcord.SlashOption(description="Minimum price per hour (in thousands)", required=False),
+    max_price: float = nextcord.SlashOption(description="Maximum price per hour (in thousands)", required=False),
+    keyword: str = nextcord.SlashOption(description="Search talents and games", required=False),
+):
+    try:
+        await interaction.response.defer()
+    except nextcord.errors.NotFound:
+        return
+
+    query = {}
+    if game:
+        query['GameTags'] = ' '.join(game.split()).casefold()
+    if city:
+        query['CityKey'] = city.strip().casefold()
+    if show_cam:
+        query['ShowCam'] = show_cam
+    if min_price is not None or max_price is not None:
+        query['PricePerHour'] = {}
+        if min_price is not None:
+            query['PricePerHour']['$gte'] = int(min_price * 1000)
+        if max_price is not None:
+            query['PricePerHour']['$lte'] = int(max_price * 1000)
+    if keyword:
+        query['$text'] = {'$search': keyword}
+
+    try:
+        settings = await guild_settings.get(interaction.guild)
+        view = PlayerSearchView(query, currency=settings['Currency'])
+        content = await view.load_page()
+        await interaction.followup.send(content, view=view)
+    except PyMongoError as e:
+        await interaction.followup.send(f"A database error occurred: {str(e)}")
+
+@bot.slash_command(name="availability", description="Show a player's free time slots")
+async def availability(
+    interaction: nextcord.Interaction,
+    player_name: str = nextcord.SlashOption(description="Player's name"),
+    days: int = nextcord.SlashOption(description="Number of days to show", required=False, default=7, min_value=1, max_value=30),
+):
+    try:
+        await interaction.response.defer()
+    except nextcord.errors.NotFound:
+        return
+
+    try:
+        player = await player_cache.find_by_name(player_name)
+        if not player:
+            await interaction.followup.send("Player not found. Please check the name and try again.")
+            return
+
+        now = datetime.now().replace(second=0, microsecond=0)
+        free_slots = await find_free_slots(player['PlayerID'], now, now + timedelta(days=days))
+        timezone = (await guild_settings.get(interaction.guild))['Timezone']
+
+        lines = [f"Free time slots for {player['PlayerName']} in the next {days} days:"]
+        for start, end in free_slots[:20]:
+            start, end = to_guild_time(start, timezone), to_guild_time(end, timezone)
+            lines.append(f"{start.strftime('%d/%m/%Y %H:%M')} - {end.strftime('%d/%m/%Y %H:%M')}")
+        if len(free_slots) > 20:
+            lines.append(f"...and {len(free_slots) - 20} more")
+        await interaction.followup.send("\n".join(lines))
+    except PyMongoError as e:
+        await interaction.followup.send(f"A database error occurred: {str(e)}")
+
+@bot.slash_command(name="stats", description="Show rental hours and spending over time")
+async def stats(
+    interaction: nextcord.Interaction,
+    user: nextcord.Member = nextcord.SlashOption(description="Player or boss to show (defaults to you)", required=False),
+    period: str = nextcord.SlashOption(description="Group by day or week", choices=["day", "week"], required=False, default="day"),
+    days: int = nextcord.SlashOption(description="Number of days to include", required=False, default=30, min_value=1, max_value=365),
+):
+    try:
+        await interaction.response.defer()
+    except nextcord.errors.NotFound:
+        return
+
+    user_id = str((user or interaction.user).id)
+    since = datetime.now() - timedelta(days=days)
+    match = {'$match': {
+        '$or': [{'PlayerID': user_id}, {'BossID': user_id}],
+        'Status': {'$in': FINISHED_STATUSES},
+        'ActualEndTime': {'$gte': since}
+    }}
+    pipeline = [
+        match,
+        # Rentals older than RENTAL_ARCHIVE_AFTER_DAYS live in the archive
+        {'$unionWith': {'coll': 'RentalsArchive', 'pipeline': [match]}},
+        {'$group': {
+            '_id': {
+                'Period': {'$dateTrunc': {'date': '$ActualEndTime', 'unit': period}},
+                'Role': {'$cond': [{'$eq': ['$PlayerID', user_id]}, 'Player', 'Boss']}
+            },
+            'Hours': {'$sum': '$ActualDuration'},
+            'Revenue': {'$sum': '$TotalPrice'},
+            'Rentals': {'$sum': 1}
+        }},
+        {'$sort': {'_id.Period': 1, '_id.Role': 1}}
+    ]
+
+    try:
+        settings = await guild_settings.get(interaction.guild)
+        db = get_database()
+        rows = await db.Rentals.aggregate(pipeline)
+    except PyMongoError as e:
+        await interaction.followup.send(f"A database error occurred: {str(e)}")
+        return
+
+    if not rows:
+        await interaction.followup.send(f"No finished rentals for <@{user_id}> in the last {days} days.", allowed_mentions=nextcord.AllowedMentions.none())
+        return
+
+    lines = [f"Rental stats for <@{user_id}> (last {days} days, by {period}):"]
+    for row in rows[-20:]:
+        label = 'earned' if row['_id']['Role'] == 'Player' else 'spent'
+        lines.append(
+            f"{row['_id']['Period'].strftime('%d/%m/%Y')} as {row['_id']['Role'].lower()}: "
+            f"{row['Hours']:.2f} hours, {format_price(row['Revenue'], settings['Currency'])} {label} ({row['Rentals']} rentals)"
+        )
+    await interaction.followup.send("\n".join(lines), allowed_mentions=nextcord.AllowedMentions.none())
+
+@bot.slash_command(name="leaderboard", description="Show the top players or bosses", dm_permission=False)
+async def leaderboard(
+    interaction: nextcord.Interaction,
+    role: str = nextcord.SlashOption(description="Rank players or bosses", choices=["Player", "Boss"], required=False, default="Player"),
+    metric: str = nextcord.SlashOption(description="Rank by hours or revenue", choices=["Hours", "Revenue"], required=False, default="Hours"),
+    days: int = nextcord.SlashOption(description="Number of days to include", required=False, default=7, min_value=1, max_value=365),
+):
+    try:
+        await interaction.response.defer()
+    except nextcord.errors.NotFound:
+        return
+
+    since = (datetime.now() - timedelta(days=days)).replace(hour=0, minute=0, second=0, microsecond=0)
+    # Answered from the daily rollups, not from the Rentals history
+    pipeline = [
+        # This server's rollups, plus those of rentals recorded before bookings stored their guild
+        {'$match': {'Role': role, 'Day': {'$gte': since}, 'GuildID': {'$in': [interaction.guild_id, NO_GUILD_ID]}}},
+        {'$group': {'_id': '$UserID', 'Hours': {'$sum': '$Hours'}, 'Revenue': {'$sum': '$Revenue'}, 'Rentals': {'$sum': '$Rentals'}}},
+        {'$sort': {metric: -1}},
+        {'$limit': 10}
+    ]
+
+    try:
+        settings = await guild_settings.get(interaction.guild)
+        db = get_database()
+        rows = await db.RentalStats.aggregate(pipeline)
+    except PyMongoError as e:
+        await interaction.followup.send(f"A database error occurred: {str(e)}")
+        return
+
+    if not rows:
+        await interaction.followup.send(f"No finished rentals in the last {days} days.")
+        return
+
+    lines = [f"Top {role.lower()}s by {metric.lower()} (last {days} days):"]
+    for rank, row in enumerate(rows, start=1):
+        lines.append(f"{rank}. <@{row['_id']}> - {row['Hours']:.2f} hours, {format_price(row['Revenue'], settings['Currency'])} ({row['Rentals']} rentals)")
+    await interaction.followup.send("\n".join(lines), allowed_mentions=nextcord.AllowedMentions.none())
+
+@bot.slash_command(
+    name="latency",
+    description="Show interaction latency percentiles (admin only)",
+    default_member_permissions=nextcord.Permissions(administrator=True)
+)
+async def latency(interaction: nextcord.Interaction):
+    summary = tracer.summary()
+    if not summary:
+        await interaction.response.send_message("No traced interactions yet.", ephemeral=True)
+        return
+
+    lines = ["span (count, errors): p50 / p95 / p99 ms"]
+    for name, span in sorted(summary.items()):
+        lines.append(f"{name} ({span['count']}, {span['errors']}): {span['p50'] * 1000:.0f} / {span['p95'] * 1000:.0f} / {span['p99'] * 1000:.0f}")
+        for stage_name, timings in sorted(span['stages'].items()):
+            lines.append(f"  {stage_name}: {timings['p50'] * 1000:.0f} / {timings['p95'] * 1000:.0f} / {timings['p99'] * 1000:.0f}")
+
+    content = "\n".join(lines)
+    if len(content) > 1900:
+        content = content[:1900] + "\n..."
+    await interaction.response.send_message(f"```\n{content}\n```", ephemeral=True)
+
+@bot.slash_command(
+    name="config",
+    description="Show or change this server's bot settings (admin only)",
+    default_member_permissions=nextcord.Permissions(administrator=True),
+    dm_permission=False
+)
+async def config(
+    interaction: nextcord.Interaction,
+    customer_role: nextcord.Role = nextcord.SlashOption(description="Role allowed to submit requests", required=False),
+    player_role: nextcord.Role = nextcord.SlashOption(description="Role players must have to receive requests", required=False),
+    booking_channel: nextcord.TextChannel = nextcord.SlashOption(description="Channel for booking requests and rental notices", required=False),
+    currency: str = nextcord.SlashOption(description="Currency shown with prices, e.g. VND", required=False, max_length=8),
+    timezone: str = nextcord.SlashOption(description="IANA timezone for entered times, e.g. Asia/Ho_Chi_Minh", required=False),
+):
+    changes = {}
+    if customer_role is not None:
+        changes['CustomerRoleID'] = customer_role.id
+    if player_role is not None:
+        changes['PlayerRoleID'] = player_role.id
+    if booking_channel is not None:
+        changes['BookingChannelID'] = booking_channel.id
+    if currency:
+        changes['Currency'] = currency.strip().upper()
+    if timezone:
+        try:
+            ZoneInfo(timezone)
+        except (ZoneInfoNotFoundError, ValueError):
+            await interaction.response.send_message(f"Unknown timezone: {timezone}", ephemeral=True)
+            return
+        changes['Timezone'] = timezone
+
+    try:
+        if changes:
+            settings = await guild_settings.update(interaction.guild, **changes)
+        else:
+            settings = await guild_settings.get(interaction.guild)
+    except PyMongoError as e:
+        await interaction.response.send_message(f"A database error occurred: {str(e)}", ephemeral=True)
+        return
+
+    def mention(value, prefix):
+        return f"<{prefix}{value}>" if value else "not set"
+
+    lines = [
+        "Settings updated:" if changes else "Current settings:",
+        f"Customer role: {mention(settings['CustomerRoleID'], '@&')}",
+        f"Player role: {mention(settings['PlayerRoleID'], '@&')}",
+        f"Booking channel: {mention(settings['BookingChannelID'], '#')}",
+        f"Currency: {settings['Currency']}",
+        f"Timezone: {settings['Timezone'] or 'bot server time'}",
+    ]
+    await interaction.response.send_message("\n".join(lines), ephemeral=True)
+
+class PlayerSearchView(nextcord.ui.View):
+    """Pages through /players results, cheapest first, using (PricePerHour, _id) keyset pagination.
+
+    The sort matches the Players search indexes, so each page is read from
+    the index after the previous page's last key. Each page fetches one extra
+    document to know whether a next page exists, and only the displayed
+    fields are projected.
+    """
+
+    projection = {'PlayerName': 1, 'City': 1, 'ShowCam': 1, 'PricePerHour': 1, 'Games': 1}
+
+    def __init__(self, query, page_size=PLAYER_SEARCH_PAGE_SIZE, currency=DEFAULT_GUILD_SETTINGS['Currency']):
+        super().__init__()
+        self.query = query
+        self.currency = currency
+        self.page_size = page_size
+        # (PricePerHour, _id) each visited page starts after; None is the first page
+        self.page_starts = [None]
+        self.next_start = None
+
+    async def load_page(self):
+        query = dict(self.query)
+        if self.page_starts[-1] is not None:
+            price, last_id = self.page_starts[-1]
+            query['$or'] = [{'PricePerHour': {'$gt': price}}, {'PricePerHour': price, '_id': {'$gt': last_id}}]
+
+        db = get_database()
+        results = await db.Players.find(query, self.projection, sort=[('PricePerHour', 1), ('_id', 1)], limit=self.page_size + 1)
+        page = results[:self.page_size]
+        self.next_start = (page[-1]['PricePerHour'], page[-1]['_id']) if len(results) > self.page_size else None
+
+        self.previous_button.disabled = len(self.page_starts) == 1
+        self.next_button.disabled = self.next_start is None
+
+        if not page:
+            return "No players match your search."
+
+        lines = [f"Players (page {len(self.page_starts)}):"]
+        for player in page:
+            lines.append(
+                f"**{player['PlayerName']}** - {player.get('City', '?')} - "
+                f"{format_price(player['PricePerHour'], self.currency)}/hour - Cam: {player.get('ShowCam', '?')} - "
+                f"Games: {player.get('Games', '')}"
+            )
+        return "\n".join(lines)
+
+    @nextcord.ui.button(label="Previous", style=nextcord.ButtonStyle.secondary)
+    async def previous_button(self, button: nextcord.ui.Button, interaction: nextcord.Interaction):
+        if len(self.page_starts) > 1:
+            self.page_starts.pop()
+        await self.show_page(interaction)
+
+    @nextcord.ui.button(label="Next", style=nextcord.ButtonStyle.primary)
+    async def next_button(self, button: nextcord.ui.Button, interaction: nextcord.Interaction):
+        if self.next_start is not None:
+            self.page_starts.append(self.next_start)
+        await self.show_page(interaction)
+
+    async def show_page(self, interaction):
+        try:
+            content = await self.load_page()
+            await interaction.response.edit_message(content=content, view=self)
+        except PyMongoError as e:
+            await interaction.response.send_message(f"A database error occurred: {str(e)}", ephemeral=True)
+
 # Main view with booking and register buttons
 class MainView(nextcord.ui.View):
     def __init__(self):
         super().__init__()
     
     @nextcord.ui.button(label="Booking", style=nextcord.ButtonStyle.primary)
+    @traced('main_view.booking')
     async def booking_button(self, button: nextcord.ui.Button, interaction: nextcord.Interaction):
         await interaction.response.send_modal(BookingModal())
 
     @nextcord.ui.button(label="Register", style=nextcord.ButtonStyle.secondary)
+    @traced('main_view.register')
     async def register_button(self, button: nextcord.ui.Button, interaction: nextcord.Interaction):
-        await interaction.response.send_modal(RegisterModal())
+        # A modal must be the first response, so settings come from the cache only
+        settings = guild_settings.peek(interaction.guild)
+        await interaction.response.send_modal(RegisterModal(settings['Currency']))
         
     @nextcord.ui.button(label="Request", style=nextcord.ButtonStyle.success)
+    @traced('main_view.request')
     async def request_button(self, button: nextcord.ui.Button, interaction: nextcord.Interaction):
-        customer_role = nextcord.utils.get(interaction.guild.roles, name="Customer")
-        if customer_role and customer_role in interaction.user.roles:
-            await interaction.response.send_modal(RequestModal())
+        settings = guild_settings.peek(interaction.guild)
+        if has_role(interaction.user, settings['CustomerRoleID']):
+            await interaction.response.send_modal(RequestModal(settings['Currency']))
         else:
-            await interaction.response.send_message("You need the 'Customer' role to use this feature.", ephemeral=True)
+            await interaction.response.send_message("You need the customer role to use this feature.", ephemeral=True)
 
 # Booking modal
 class BookingModal(nextcord.ui.Modal):
@@ -91,71 +1192,80 @@ class BookingModal(nextcord.ui.Modal):
         self.add_item(self.rent_hours)
         self.add_item(self.rent_time)
 
+    @traced('booking_modal')
+    @once_per_interaction
     async def callback(self, interaction: nextcord.Interaction):
         try:
-            await interaction.response.defer()
+            with stage('defer'):
+                await interaction.response.defer()
         except nextcord.errors.NotFound:
             print("Interaction has already been responded to or timed out")
             return
 
         try:
-            db = get_database_connection()
-        
-            print(f"Debug: Searching for boss: {self.boss_username.value}")
-            print(f"Debug: Guild members: {[member.name for member in interaction.guild.members]}")
+            db = get_database()
             
             # Check if the input is a user mention
             if self.boss_username.value.startswith('<@') and self.boss_username.value.endswith('>'):
                 boss_id = self.boss_username.value[2:-1]
                 if boss_id.startswith('!'):
                     boss_id = boss_id[1:]
-                player = interaction.guild.get_member(int(boss_id))
-                print(f"Debug: Mention detected. Player ID: {boss_id}, Boss found: {boss is not None}")
+                boss = interaction.guild.get_member(int(boss_id)) if boss_id.isdigit() else None
             else:
-                # Try to find the player by username or display name
-                boss = None
-                for member in interaction.guild.members:
-                    if member.name.lower() == self.boss_username.value.lower() or \
-                       member.display_name.lower() == self.boss_username.value.lower():
-                        boss = member
-                        break
-                print(f"Debug: Name search. Boss found: {boss is not None}")
+                # Look the boss up by username or display name
+                with stage('resolve_boss'):
+                    boss = await member_index.resolve(interaction.guild, self.boss_username.value)
             
             if boss:
                 boss_id = str(boss.id)
-                print(f"Debug: Player found. ID: {boss_id}")
             else:
                 await interaction.followup.send("Boss not found. Please check the username, display name, or use @mention and try again.")
                 return
 
-            db.Boss.update_one(
-                {'BossID': boss_id},
-                {'$set': {'BossName': self.boss_username.value}},
-                upsert=True
-            )
+            # Another worker handling the same submission stops here, before any write
+            if not await interaction_dedupe.confirm(interaction.id):
+                return
+            await upsert_boss(boss_id, self.boss_username.value)
+            settings = await guild_settings.get(interaction.guild)
             
-            player = db.Players.find_one({'PlayerName': self.player_name.value})
+            player = await player_cache.find_by_name(self.player_name.value)
         
             if player:
                 player_id = player['PlayerID']
                 price_per_hour = player['PricePerHour']
-                requested_start_time = datetime.strptime(self.rent_time.value, "%d/%m/%Y %H:%M")
+                requested_start_time = parse_local_time(self.rent_time.value, settings['Timezone'])
                 rent_hours = float(self.rent_hours.value)
                 total_price = int(rent_hours * price_per_hour)
+                requested_end_time = requested_start_time + timedelta(hours=rent_hours)
+
+                if await find_conflicting_rental(player_id, requested_start_time, requested_end_time):
+                    await interaction.followup.send("The player already has a booking overlapping that time. Use /availability to see their free slots.")
+                    return
             
-                db.Rentals.insert_one({
-                    'BossID': boss_id,
-                    'PlayerID': player_id,
-                    'RequestedDuration': rent_hours,
-                    'TotalPrice': total_price,
-                    'RequestedStartTime': requested_start_time,
-                    'Status': 'Pending'
-                })
-            
-                view = AcceptDeclineView(boss_id, player_id, rent_hours, requested_start_time)
-                await interaction.channel.send(f"New booking request from <@{boss_id}> for <@{player_id}>. Total price: {total_price // 1000}K VND. Requested start time: {requested_start_time}. Please accept or decline:", view=view)
+                channel = booking_channel(settings, interaction)
+                try:
+                    result = await db.Rentals.insert_one({
+                        'BossID': boss_id,
+                        'PlayerID': player_id,
+                        'RequestedDuration': rent_hours,
+                        'TotalPrice': total_price,
+                        'RequestedStartTime': requested_start_time,
+                        'RequestedEndTime': requested_end_time,
+                        'ChannelID': channel.id,
+                        'GuildID': interaction.guild_id,
+                        'Status': 'Pending'
+                    })
+                except DuplicateKeyError:
+                    # The same form submitted twice; the first submission already posted the request
+                    metrics.DUPLICATES_SUPPRESSED.inc(kind='booking')
+                    await interaction.followup.send("This booking request was already submitted. Waiting for player's confirmation.")
+                    return
             
-                await interaction.followup.send("Booking request submitted. Waiting for player's confirmation.")
+                view = AcceptDeclineView(boss_id, player_id, rent_hours, requested_start_time, result.inserted_id)
+                timestamp = int(requested_start_time.timestamp())
+                with stage('send'):
+                    await outbox.send(channel, f"New booking request from <@{boss_id}> for <@{player_id}>. Total price: {format_price(total_price, settings['Currency'])}. Requested start time: <t:{timestamp}:F>. Please accept or decline:", view=view, priority=outbound.USER, reason='booking_request')
+                    await interaction.followup.send("Booking request submitted. Waiting for player's confirmation.")
             else:
                 await interaction.followup.send("Player not found. Please check the name and try again.")
     
@@ -170,8 +1280,9 @@ class BookingModal(nextcord.ui.Modal):
 
 # Register modal
 class RegisterModal(nextcord.ui.Modal):
-    def __init__(self):
+    def __init__(self, currency=DEFAULT_GUILD_SETTINGS['Currency']):
         super().__init__(title="Register as Player", timeout=5 * 60)
+        self.currency = currency
         
         self.personal_info = nextcord.ui.TextInput(
             label="Name, Birthday, City, Show Cam (yes/no)",
@@ -180,7 +1291,7 @@ class RegisterModal(nextcord.ui.Modal):
         )
         
         self.price = nextcord.ui.TextInput(
-            label="Price per hour (in K VND)",
+            label=f"Price per hour (in K {currency})",
             style=nextcord.TextInputStyle.short
         )
         
@@ -205,6 +1316,7 @@ class RegisterModal(nextcord.ui.Modal):
         self.add_item(self.talent)
         self.add_item(self.games)
 
+    @traced('register_modal')
     async def callback(self, interaction: nextcord.Interaction):
         try:
             personal_info_parts = self.personal_info.value.split(',')
@@ -228,23 +1340,26 @@ class RegisterModal(nextcord.ui.Modal):
             # Convert price to VND (removing 'K' and multiplying by 1000)
             price_in_vnd = int(float(self.price.value.replace('K', '')) * 1000)
 
-            db = get_database_connection()
-            db.Players.update_one(
+            profile = {
+                'PlayerName': name,
+                'Birthday': birthday,
+                'City': city,
+                'ShowCam': show_cam,
+                'PricePerHour': price_in_vnd,
+                'SocialLink': self.social_link.value,
+                'Talent': self.talent.value,
+                'Games': self.games.value,
+                **player_search_fields(city, self.games.value)
+            }
+
+            db = get_database()
+            await db.write_buffer.submit('Players', pymongo.UpdateOne(
                 {'PlayerID': str(interaction.user.id)},
-                {
-                    '$set': {
-                        'PlayerName': name,
-                        'Birthday': birthday,
-                        'City': city,
-                        'ShowCam': show_cam,
-                        'PricePerHour': price_in_vnd,
-                        'SocialLink': self.social_link.value,
-                        'Talent': self.talent.value,
-                        'Games': self.games.value
-                    }
-                },
+                {'$set': profile},
                 upsert=True
-            )
+            ))
+            # Write-through so the next booking sees the new profile immediately
+            player_cache.put({'PlayerID': str(interaction.user.id), **profile})
         
             # Prepare summary of registered information
             summary = f"Registration submitted for {name}. Your information has been stored:\n"
@@ -253,265 +1368,978 @@ class RegisterModal(nextcord.ui.Modal):
             summary += f"Birthday: {birthday}\n"
             summary += f"City: {city}\n"
             summary += f"Show Cam: {show_cam}\n"
-            summary += f"Price per hour: {price_in_vnd // 1000}K VND\n"
+            summary += f"Price per hour: {format_price(price_in_vnd, self.currency)}\n"
             summary += f"Social Link: {self.social_link.value}\n"
             summary += f"Talents: {self.talent.value}\n"
             summary += f"Games: {self.games.value}\n"
 
-            await interaction.response.send_message(summary)
+            with stage('send'):
+                await interaction.response.send_message(summary)
         except PyMongoError as e:
             await interaction.response.send_message(f"A database error occurred: {str(e)}. Please try again or contact an administrator.")
         except Exception as e:
             await interaction.response.send_message(f"An error occurred: {str(e)}. Please try again or contact an administrator.")
 
 class RequestModal(nextcord.ui.Modal):
-    def __init__(self):
+    def __init__(self, currency=DEFAULT_GUILD_SETTINGS['Currency']):
         super().__init__(title="Request Information")
-        
+
+        self.game = nextcord.ui.TextInput(label="Game", placeholder="e.g. League of Legends")
+        self.rent_time = nextcord.ui.TextInput(label="Start Time", placeholder="Enter start time (DD/MM/YYYY HH:MM)")
+        self.rent_hours = nextcord.ui.TextInput(label="Rent Hours", placeholder="Enter number of hours")
+        self.budget = nextcord.ui.TextInput(label=f"Budget per hour (in K {currency})", placeholder="Maximum price per hour, e.g. 100K")
         self.request_info = nextcord.ui.TextInput(
             label="Booking Request",
             style=nextcord.TextInputStyle.paragraph,
-            placeholder="Enter the booking request details",
-            required=True
+            placeholder="Anything else the player should know",
+            required=False
         )
-        
+
+        self.add_item(self.game)
+        self.add_item(self.rent_time)
+        self.add_item(self.rent_hours)
+        self.add_item(self.budget)
         self.add_item(self.request_info)
 
+    @traced('request_modal')
+    @once_per_interaction
     async def callback(self, interaction: nextcord.Interaction):
         try:
-            await interaction.response.defer()
+            with stage('defer'):
+                await interaction.response.defer()
         except nextcord.errors.NotFound:
             print("Interaction has already been responded to or timed out")
             return
 
         try:
-            # Prepare the request summary
-            summary = f"New booking request:\n"
-            summary += self.request_info.value
+            game_tags = tokenize_games(self.game.value)
+            if not game_tags:
+                await interaction.followup.send("Please enter the game you want to play.")
+                return
+            settings = await guild_settings.get(interaction.guild)
+            requested_start_time = parse_local_time(self.rent_time.value, settings['Timezone'])
+            rent_hours = float(self.rent_hours.value)
+            max_price = int(float(self.budget.value.upper().replace('K', '')) * 1000)
+            requested_end_time = requested_start_time + timedelta(hours=rent_hours)
+            boss_id = str(interaction.user.id)
 
-            # Get the Player role ID
-            player_role_id = 1269185895995805708
-            summary = f"<@&{player_role_id}> {summary}"
+            players = await find_matching_players(game_tags[0], max_price, requested_start_time, requested_end_time,
+                                                  exclude=[boss_id])
+            # Only current members, and only those with the player role when one is configured
+            members = {}
+            for player in players:
+                member = interaction.guild.get_member(int(player['PlayerID']))
+                if member and (settings['PlayerRoleID'] is None or has_role(member, settings['PlayerRoleID'])):
+                    members[player['PlayerID']] = member
+            players = [player for player in players if player['PlayerID'] in members]
+            if not players:
+                await interaction.followup.send("No available player matches this game, time and budget. Try another time or a higher budget.")
+                return
 
-            await interaction.followup.send(summary, allowed_mentions=nextcord.AllowedMentions(roles=True))
+            if not await interaction_dedupe.confirm(interaction.id):
+                return
+            db = get_database()
+            result = await db.Requests.insert_one({
+                'BossID': boss_id,
+                'Game': self.game.value,
+                'GameTag': game_tags[0],
+                'RequestedStartTime': requested_start_time,
+                'RequestedEndTime': requested_end_time,
+                'RequestedDuration': rent_hours,
+                'MaxPricePerHour': max_price,
+                'Details': self.request_info.value or '',
+                'Candidates': players,
+                'Currency': settings['Currency'],
+                'ChannelID': booking_channel(settings, interaction).id,
+                'GuildID': interaction.guild_id,
+                'Status': 'Open',
+                'CreatedAt': datetime.now()
+            })
+
+            # Only the matched players are notified, through the rate-limited outbox
+            timestamp = int(requested_start_time.timestamp())
+            summary = (f"New booking request from <@{boss_id}>: {self.game.value}, {rent_hours:g} hours "
+                       f"starting <t:{timestamp}:F> (<t:{timestamp}:R>), up to {format_price(max_price, settings['Currency'])}/hour.")
+            if self.request_info.value:
+                summary += f"\n{self.request_info.value}"
+            summary += "\nThe first player to claim it gets the booking."
+
+            view = ClaimRequestView(result.inserted_id)
+            sends = [outbox.send(members[player['PlayerID']], summary, view=view, reason='request_dm') for player in players]
+            with stage('send'):
+                delivered = sum(1 for message in await asyncio.gather(*sends) if message is not None)
+
+            await interaction.followup.send(f"Request sent to {delivered} matching players. You'll be notified here when one of them claims it.")
+        except ValueError:
+            await interaction.followup.send("Invalid request. Use DD/MM/YYYY HH:MM for the start time and numbers for hours and budget.")
+        except PyMongoError as e:
+            error_message = f"A database error occurred: {str(e)}"
+            print(error_message)
+            await interaction.followup.send(error_message)
         except Exception as e:
             error_message = f"An error occurred: {str(e)}"
             print(f"Debug: {error_message}")
             await interaction.followup.send(error_message)
-    
+
+class ClaimRequestView(nextcord.ui.View):
+    """Claim button DMed to every matched player; the first claim books the player.
+
+    The view only renders the button and is not stored (``prevent_update=False``):
+    Discord delivers DM clicks on shard 0, which may be another worker, so
+    every worker routes ``request:<id>:claim`` clicks to :func:`claim_request`.
+    """
+
+    def __init__(self, request_id):
+        super().__init__(timeout=None, prevent_update=False)
+        self.add_item(nextcord.ui.Button(label="Claim", style=nextcord.ButtonStyle.green, custom_id=f"request:{request_id}:claim"))
+
+CLAIM_CUSTOM_ID = re.compile(r'request:([0-9a-f]{24}):claim')
+
+@bot.listen('on_interaction')
+async def route_request_claim(interaction):
+    if interaction.type != nextcord.InteractionType.component:
+        return
+    match = CLAIM_CUSTOM_ID.fullmatch((interaction.data or {}).get('custom_id', ''))
+    if match:
+        await claim_request(ObjectId(match.group(1)), interaction)
+
+@traced('claim_request')
+@once_per_interaction
+async def claim_request(request_id, interaction: nextcord.Interaction):
+    """Book the clicking player on an open request, loaded from MongoDB; the first claim wins."""
+    player_id = str(interaction.user.id)
+    now = datetime.now()
+    db = get_database()
+    try:
+        request = await db.Requests.find_one({'_id': request_id, 'Candidates.PlayerID': player_id})
+        if request is None:
+            await interaction.response.send_message("This request was not offered to you.", ephemeral=True)
+            return
+        if request['Status'] != 'Open' or request['RequestedEndTime'] <= now:
+            await interaction.response.send_message("Sorry, this request has already been claimed or has expired.")
+            return
+        if not await interaction_dedupe.confirm(interaction.id):
+            return
+        # The overlap check and the insert run under the player's lock, so an accept or another
+        # claim for the same player cannot book the same time in between
+        async with player_booking_lock(player_id) as locked:
+            if not locked:
+                await interaction.response.send_message("Your bookings are being updated. Please click Claim again in a moment.", ephemeral=True)
+                return
+            if await find_conflicting_rental(player_id, request['RequestedStartTime'], request['RequestedEndTime']):
+                await interaction.response.send_message("You already have a booking overlapping this request.")
+                return
+
+            # First claim wins: only one update can move the request out of Open
+            claimed = await db.Requests.find_one_and_update(
+                {'_id': request_id, 'Status': 'Open'},
+                {'$set': {'Status': 'Claimed', 'ClaimedBy': player_id, 'ClaimedAt': now}},
+                projection={'_id': 1}
+            )
+            if claimed is None:
+                await interaction.response.send_message("Sorry, another player claimed this request first.")
+                return
+
+            price_per_hour = next(player['PricePerHour'] for player in request['Candidates'] if player['PlayerID'] == player_id)
+            boss_id, rent_hours = request['BossID'], request['RequestedDuration']
+            requested_start_time, channel_id = request['RequestedStartTime'], request['ChannelID']
+            guild_id = request.get('GuildID')
+            # A click from another shard's guild is booked here but run by a worker connected
+            # to that guild: without a lease or start time its heartbeat adopts and starts it
+            local = guild_id is None or bot.get_guild(guild_id) is not None
+            start_now = local and requested_start_time <= now
+            rental = {
+                'BossID': boss_id,
+                'PlayerID': player_id,
+                'RequestedDuration': rent_hours,
+                'TotalPrice': int(rent_hours * price_per_hour),
+                'RequestedStartTime': requested_start_time,
+                'RequestedEndTime': request['RequestedEndTime'],
+                'ChannelID': channel_id,
+                'GuildID': guild_id,
+                'RequestID': request_id,
+                'Status': 'Accepted'
+            }
+            if local:
+                rental.update(rental_lease())
+            if start_now:
+                rental['ActualStartTime'] = now
+            try:
+                result = await db.Rentals.insert_one(rental)
+            except PyMongoError:
+                # Without a rental the claim must not stand; reopen the request for the other candidates
+                await db.Requests.update_one(
+                    {'_id': request_id, 'Status': 'Claimed', 'ClaimedBy': player_id},
+                    {'$set': {'Status': 'Open'}, '$unset': {'ClaimedBy': '', 'ClaimedAt': ''}}
+                )
+                raise
+    except DuplicateKeyError:
+        # A booking for the same boss and start time was made for this player meanwhile
+        await interaction.response.send_message("You already have a booking overlapping this request.")
+        return
+    except PyMongoError as err:
+        await interaction.response.send_message(f"A database error occurred: {err}. Please try again or contact an administrator.")
+        return
+
+    await interaction.response.send_message("You claimed this request. The booking is confirmed!")
+
+    # The booking channel may belong to a guild this worker is not connected to
+    channel = bot.get_channel(channel_id) or bot.get_partial_messageable(channel_id)
+    outbox.send(channel, f"<@{boss_id}> Your request was claimed by <@{player_id}>. Total price: {format_price(rental['TotalPrice'], request.get('Currency', DEFAULT_GUILD_SETTINGS['Currency']))}.",
+                priority=outbound.USER, reason='request_claimed')
+    if not local:
+        return
+    if start_now:
+        await bot.rental_timer.start_timer(result.inserted_id, boss_id, player_id, rent_hours, channel_id, now)
+    else:
+        bot.rental_timer.schedule_start(result.inserted_id, boss_id, player_id, rent_hours, channel_id, requested_start_time)
+
 class AcceptDeclineView(nextcord.ui.View):
-    def __init__(self, boss_id, player_id, rent_hours, requested_start_time):
+    def __init__(self, boss_id, player_id, rent_hours, requested_start_time, rental_id):
         super().__init__(timeout=None)
         self.boss_id = boss_id
         self.player_id = player_id
         self.rent_hours = rent_hours
         self.requested_start_time = requested_start_time
+        self.rental_id = rental_id
+
+        # Custom ids keyed by the rental _id keep the buttons working across restarts
+        accept_button = nextcord.ui.Button(label="Accept", style=nextcord.ButtonStyle.green, custom_id=f"rental:{rental_id}:accept")
+        accept_button.callback = self.accept
+        self.add_item(accept_button)
+
+        decline_button = nextcord.ui.Button(label="Decline", style=nextcord.ButtonStyle.red, custom_id=f"rental:{rental_id}:decline")
+        decline_button.callback = self.decline
+        self.add_item(decline_button)
 
-    @nextcord.ui.button(label="Accept", style=nextcord.ButtonStyle.green)
-    async def accept(self, button: nextcord.ui.Button, interaction: nextcord.Interaction):
+    @traced('accept_decline.accept')
+    @once_per_interaction
+    async def accept(self, interaction: nextcord.Interaction):
         if str(interaction.user.id) != str(self.player_id):
             await interaction.response.send_message("Only the player can accept this booking.", ephemeral=True)
             return
 
         actual_start_time = datetime.now()
-        db = get_database_connection()
-        try:
-            result = db.Rentals.update_one(
-                {
-                    'BossID': self.boss_id,
-                    'PlayerID': self.player_id,
-                    'RequestedStartTime': self.requested_start_time,
-                    'Status': 'Pending'
-                },
-                {
-                    '$set': {
-                        'Status': 'Accepted',
-                        'ActualStartTime': actual_start_time
-                    }
-                }
-            )
+        # Bookings whose requested start has already passed begin immediately
+        start_now = self.requested_start_time <= actual_start_time
+        # The accepting worker takes the lease and runs the rental's timers
+        update = {'Status': 'Accepted', 'ChannelID': interaction.channel.id, **rental_lease()}
+        if start_now:
+            update['ActualStartTime'] = actual_start_time
+
+        requested_end_time = self.requested_start_time + timedelta(hours=self.rent_hours)
+
+        db = get_database()
+        # Double clicks queue here; the second one finds the rental no longer pending
+        async with bot.rental_timer.lock(self.rental_id):
+            try:
+                if not await interaction_dedupe.confirm(interaction.id):
+                    return
+                # Overlapping requests may both be pending; only the first one accepted may stand
+                async with player_booking_lock(self.player_id) as locked:
+                    if not locked:
+                        await interaction.response.send_message("Your bookings are being updated. Please click Accept again in a moment.", ephemeral=True)
+                        return
+                    if await find_conflicting_rental(self.player_id, self.requested_start_time, requested_end_time, ['Accepted']):
+                        await interaction.response.send_message("You already accepted a booking overlapping this one. Please decline it instead.")
+                        return
+                    rental = await db.Rentals.find_one_and_update(
+                        {'_id': self.rental_id, 'Status': 'Pending'},
+                        {'$set': update},
+                        projection={'_id': 1}
+                    )
         
-            if result.modified_count > 0:
-                # Start the timer when the booking is accepted
-                await bot.rental_timer.start_timer(self.boss_id, self.player_id, self.rent_hours, interaction.channel.id, actual_start_time)
-            
-                await interaction.response.send_message(f"Booking accepted! The countdown has started at {actual_start_time}.")
-            else:
-                await interaction.response.send_message("Unable to accept the booking. It may have been cancelled or already accepted.")
-        except PyMongoError as err:
-            await interaction.response.send_message(f"A database error occurred: {err}. Please try again or contact an administrator.")
+                if rental:
+                    if start_now:
+                        with stage('send'):
+                            await interaction.response.send_message(f"Booking accepted! The countdown has started at {actual_start_time}.")
+                        await bot.rental_timer.start_timer(self.rental_id, self.boss_id, self.player_id, self.rent_hours, interaction.channel.id, actual_start_time)
+                    else:
+                        timestamp = int(self.requested_start_time.timestamp())
+                        with stage('send'):
+                            await interaction.response.send_message(f"Booking accepted! The rental will start at <t:{timestamp}:F> (<t:{timestamp}:R>).")
+                        bot.rental_timer.schedule_start(self.rental_id, self.boss_id, self.player_id, self.rent_hours, interaction.channel.id, self.requested_start_time)
+                else:
+                    await interaction.response.send_message("Unable to accept the booking. It may have been cancelled or already accepted.")
+            except PyMongoError as err:
+                await interaction.response.send_message(f"A database error occurred: {err}. Please try again or contact an administrator.")
     
         self.stop()
 
-    @nextcord.ui.button(label="Decline", style=nextcord.ButtonStyle.red)
-    async def decline(self, button: nextcord.ui.Button, interaction: nextcord.Interaction):
+    @traced('accept_decline.decline')
+    @once_per_interaction
+    async def decline(self, interaction: nextcord.Interaction):
         if str(interaction.user.id) != str(self.player_id):
             await interaction.response.send_message("Only the player can decline this booking.", ephemeral=True)
             return
 
-        db = get_database_connection()
-        try:
-            result = db.Rentals.update_one(
-                {
-                    'BossID': self.boss_id,
-                    'PlayerID': self.player_id,
-                    'RequestedStartTime': self.requested_start_time,
-                    'Status': 'Pending'
-                },
-                {
-                    '$set': {
-                        'Status': 'Declined'
-                    }
-                }
-            )
+        db = get_database()
+        async with bot.rental_timer.lock(self.rental_id):
+            try:
+                if not await interaction_dedupe.confirm(interaction.id):
+                    return
+                rental = await db.Rentals.find_one_and_update(
+                    {'_id': self.rental_id, 'Status': 'Pending'},
+                    {'$set': {'Status': 'Declined'}},
+                    projection={'_id': 1}
+                )
 
-            if result.modified_count > 0:
-                decline_message = f"<@{self.boss_id}> Your booking has been declined by the player."
-                await interaction.response.send_message(decline_message)
-            else:
-                await interaction.response.send_message("Unable to decline the booking. It may have been cancelled or already processed.")
-        except PyMongoError as err:
-            await interaction.response.send_message(f"A database error occurred: {err}. Please try again or contact an administrator.")
+                if rental:
+                    decline_message = f"<@{self.boss_id}> Your booking has been declined by the player."
+                    await interaction.response.send_message(decline_message)
+                else:
+                    await interaction.response.send_message("Unable to decline the booking. It may have been cancelled or already processed.")
+            except PyMongoError as err:
+                await interaction.response.send_message(f"A database error occurred: {err}. Please try again or contact an administrator.")
         
         self.stop()
 
+# Fields RentalTimer needs to restore a rental's buttons and timers
+RENTAL_RECOVERY_PROJECTION = {
+    'BossID': 1, 'PlayerID': 1, 'RequestedDuration': 1, 'RequestedStartTime': 1, 'ActualStartTime': 1,
+    'ChannelID': 1, 'ClockMessageID': 1, 'ReminderSent': 1, 'TotalPrice': 1, 'Status': 1, 'GuildID': 1,
+    'LeaseOwner': 1
+}
+
 class RentalTimer:
-    def __init__(self, bot):
+    """Owns every accepted rental and fires its events from a single scheduler.
+
+    Start reminders, scheduled starts and rental deadlines live in one
+    min-heap; one background task sleeps until the earliest entry (or until a
+    sooner one is pushed) instead of polling or keeping a sleeping coroutine
+    per booking. Countdown messages use Discord relative timestamps, so they stay accurate
+    without edits; the optional refresh loop updates all of them together at
+    ``refresh_seconds`` cadence (0 disables edits entirely).
+
+    With several workers, each accepted rental is run by the worker named in
+    its ``LeaseOwner`` while that worker's lease in ``Workers`` is fresh. The
+    heartbeat loop renews this worker's lease with one write, forgets rentals
+    another worker took over while it had lapsed, and adopts rentals in this
+    worker's guilds whose owner's lease expired.
+    """
+
+    def __init__(self, bot, refresh_seconds=CLOCK_REFRESH_SECONDS, reminder_minutes=REMINDER_MINUTES,
+                 lease_seconds=RENTAL_LEASE_SECONDS):
         self.bot = bot
         self.active_rentals = {}
-        self.check_rentals.start()
+        self.scheduled_rentals = {}
+        self.clock_messages = {}
+        self.refresh_seconds = refresh_seconds
+        self.reminder_minutes = reminder_minutes
+        self._deadlines = []
+        self._sequence = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._scheduler_task = None
+        self._pending_tasks = set()
+        # Per-rental locks serialise button handlers for the same rental; unused locks are dropped
+        self._locks = weakref.WeakValueDictionary()
+        # Taking over other workers' expired leases waits until recovery has run once
+        self.recovered = False
+        # Heartbeats left that re-check which rentals this worker still owns, after its lease lapsed
+        self._verify_leases = 0
+        self.lease_seconds = lease_seconds
+        if refresh_seconds > 0:
+            self.refresh_clocks.change_interval(seconds=refresh_seconds)
+        # Renew well before expiry so one slow heartbeat does not lose a lease
+        self.heartbeat.change_interval(seconds=max(lease_seconds / 3, 1))
 
-    async def start_timer(self, boss_id, player_id, duration, channel_id, start_time):
+    def lock(self, rental_id):
+        """The in-flight lock for ``rental_id``, shared by every handler touching that rental."""
+        lock = self._locks.get(rental_id)
+        if lock is None:
+            lock = self._locks[rental_id] = asyncio.Lock()
+        return lock
+
+    async def start_timer(self, rental_id, boss_id, player_id, duration, channel_id, start_time):
+        if rental_id in self.active_rentals:
+            # A retried start must not post a second clock or schedule a second end
+            metrics.DUPLICATES_SUPPRESSED.inc(kind='timer')
+            return
         end_time = start_time + timedelta(hours=duration)
-        self.active_rentals[(boss_id, player_id)] = (end_time, channel_id, start_time)
-        
-        # Start the digital clock with End Early button
-        await self.run_digital_clock(boss_id, player_id, duration, channel_id, start_time)
+        self.active_rentals[rental_id] = (end_time, channel_id, start_time, boss_id, player_id)
+        self.schedule(end_time, 'end', rental_id)
+
+        # Post the countdown with End Early button; it may wait for rate budget,
+        # so the accepting interaction does not wait on it
+        self._spawn(self.send_clock(rental_id, channel_id, end_time))
+
+    def schedule_start(self, rental_id, boss_id, player_id, duration, channel_id, start_time, reminder_sent=False):
+        """Queue an accepted booking to start at its requested start time."""
+        if rental_id in self.scheduled_rentals or rental_id in self.active_rentals:
+            metrics.DUPLICATES_SUPPRESSED.inc(kind='timer')
+            return
+        self.scheduled_rentals[rental_id] = (start_time, boss_id, player_id, duration, channel_id)
+        self.schedule(start_time, 'start', rental_id)
+
+        remind_at = start_time - timedelta(minutes=self.reminder_minutes)
+        if not reminder_sent and self.reminder_minutes > 0 and remind_at > datetime.now():
+            self.schedule(remind_at, 'remind', rental_id)
+
+    def schedule(self, when, action, key):
+        heapq.heappush(self._deadlines, (when, next(self._sequence), action, key))
+        if self._scheduler_task is None or self._scheduler_task.done():
+            self._scheduler_task = detached(asyncio.create_task, self._run_scheduler())
+        self._wakeup.set()
+
+    def _is_current(self, when, action, key):
+        # Entries for rentals that ended early, already started or were rescheduled are stale
+        if action == 'end':
+            rental = self.active_rentals.get(key)
+            return rental is not None and rental[0] == when
+        scheduled = self.scheduled_rentals.get(key)
+        if action == 'start':
+            return scheduled is not None and scheduled[0] == when
+        return scheduled is not None
+
+    async def _fire(self, when, action, key):
+        if action == 'end':
+            await self.end_rental(key, when)
+        elif action == 'start':
+            await self.begin_rental(key)
+        elif action == 'remind':
+            await self.send_reminder(key)
+
+    async def _run_scheduler(self):
+        while True:
+            now = datetime.now()
+            while self._deadlines and self._deadlines[0][0] <= now:
+                when, _, action, key = heapq.heappop(self._deadlines)
+                if self._is_current(when, action, key):
+                    self._spawn(self._fire(when, action, key))
+
+            self._wakeup.clear()
+            timeout = (self._deadlines[0][0] - now).total_seconds() if self._deadlines else None
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    def _spawn(self, coro):
+        task = detached(asyncio.create_task, coro)
+        self._pending_tasks.add(task)
+        task.add_done_callback(self._pending_tasks.discard)
+        return task
+
+    @traced('rental_timer.begin_rental')
+    async def begin_rental(self, rental_id):
+        start_time, boss_id, player_id, duration, channel_id = self.scheduled_rentals.pop(rental_id)
+        actual_start_time = datetime.now()
+
+        db = get_database()
+        try:
+            rental = await db.Rentals.find_one_and_update(
+                {'_id': rental_id, 'Status': 'Accepted', 'ActualStartTime': {'$exists': False}},
+                {'$set': {'ActualStartTime': actual_start_time}},
+                projection={'_id': 1}
+            )
+        except PyMongoError as err:
+            print(f"A database error occurred: {err}")
+            return
+
+        if rental is None:
+            print(f"Scheduled rental {rental_id} was cancelled or already started")
+            return
 
-    async def run_digital_clock(self, boss_id, player_id, duration, channel_id, start_time):
         channel = self.bot.get_channel(channel_id)
         if channel:
-            view = EndEarlyView(boss_id, player_id, self)
-            message = await channel.send("Rental time remaining: ", view=view)
-            end_time = start_time + timedelta(hours=duration)
-            
-            while datetime.now() < end_time and (boss_id, player_id) in self.active_rentals:
-                time_left = end_time - datetime.now()
-                hours, remainder = divmod(time_left.seconds, 3600)
-                minutes, seconds = divmod(remainder, 60)
-                await message.edit(content=f"Rental time remaining: {hours:02d}:{minutes:02d}:{seconds:02d}", view=view)
-                await asyncio.sleep(1)
-            
-            if (boss_id, player_id) in self.active_rentals:
-                await self.end_rental(boss_id, player_id, end_time)
-            await message.edit(content="Rental time has ended!", view=None)
-
-    async def end_rental(self, boss_id, player_id, end_time, ended_early=False):
-        if (boss_id, player_id) in self.active_rentals:
-            _, channel_id, start_time = self.active_rentals[(boss_id, player_id)]
-            del self.active_rentals[(boss_id, player_id)]
+            outbox.send(channel, f"<@{boss_id}> <@{player_id}> Your rental is starting now.", reason='start')
+        await self.start_timer(rental_id, boss_id, player_id, duration, channel_id, actual_start_time)
+
+    @traced('rental_timer.send_reminder')
+    async def send_reminder(self, rental_id):
+        start_time, boss_id, player_id, _, channel_id = self.scheduled_rentals[rental_id]
+        channel = self.bot.get_channel(channel_id)
+        if channel:
+            outbox.send(channel, f"<@{boss_id}> <@{player_id}> Reminder: your rental starts <t:{int(start_time.timestamp())}:R>.", reason='reminder')
+
+        db = get_database()
+        try:
+            await db.write_buffer.submit('Rentals', pymongo.UpdateOne({'_id': rental_id}, {'$set': {'ReminderSent': True}}))
+        except PyMongoError as err:
+            print(f"A database error occurred: {err}")
+
+    @staticmethod
+    def format_clock(end_time):
+        time_left = max(end_time - datetime.now(), timedelta(0))
+        hours, remainder = divmod(int(time_left.total_seconds()), 3600)
+        minutes = remainder // 60
+        timestamp = int(end_time.timestamp())
+        return f"Rental time remaining: {hours:02d}:{minutes:02d} (ends <t:{timestamp}:R>, at <t:{timestamp}:t>)"
+
+    async def send_clock(self, rental_id, channel_id, end_time):
+        channel = self.bot.get_channel(channel_id)
+        if channel:
+            _, _, _, boss_id, player_id = self.active_rentals[rental_id]
+            view = EndEarlyView(boss_id, player_id, self, rental_id)
+            with stage('send'):
+                message = await outbox.send(channel, self.format_clock(end_time), view=view, reason='clock')
+            if message is None:
+                return
+            self.track_clock(rental_id, message, view)
+
+            db = get_database()
+            try:
+                await db.write_buffer.submit('Rentals', pymongo.UpdateOne({'_id': rental_id}, {'$set': {'ClockMessageID': message.id}}))
+            except PyMongoError as err:
+                print(f"A database error occurred: {err}")
+
+    def track_clock(self, rental_id, message, view):
+        self.clock_messages[rental_id] = (message, view)
+        if self.refresh_seconds > 0 and not self.refresh_clocks.is_running():
+            detached(self.refresh_clocks.start)
+
+    @tasks.loop(seconds=60)
+    async def refresh_clocks(self):
+        for rental_id, (message, view) in list(self.clock_messages.items()):
+            rental = self.active_rentals.get(rental_id)
+            if rental is None:
+                continue
+            # Cosmetic: coalesced with any queued refresh and shed first under load
+            outbox.edit(message, content=self.format_clock(rental[0]), view=view, reason='clock_refresh')
+
+    @refresh_clocks.before_loop
+    async def before_refresh_clocks(self):
+        # Clocks were just posted with fresh content; skip the immediate first pass
+        await asyncio.sleep(self.refresh_seconds)
+
+    @traced('rental_timer.end_rental')
+    async def end_rental(self, rental_id, end_time, ended_early=False):
+        if rental_id in self.active_rentals:
+            _, channel_id, start_time, boss_id, player_id = self.active_rentals.pop(rental_id)
             
             actual_duration = (end_time - start_time).total_seconds() / 3600  # in hours
             
-            await self.complete_rental(boss_id, player_id, channel_id, end_time, actual_duration, ended_early)
+            await self.close_clock(rental_id)
+            await self.complete_rental(rental_id, boss_id, player_id, channel_id, end_time, actual_duration, ended_early)
+
+    async def close_clock(self, rental_id):
+        clock = self.clock_messages.pop(rental_id, None)
+        if clock:
+            message, view = clock
+            view.stop()
+            outbox.edit(message, content="Rental time has ended!", view=None, priority=outbound.NOTICE, reason='clock_closed')
 
-    async def complete_rental(self, boss_id, player_id, channel_id, end_time, actual_duration, ended_early):
+    @traced('rental_timer.complete_rental')
+    async def complete_rental(self, rental_id, boss_id, player_id, channel_id, end_time, actual_duration, ended_early):
         status = 'Ended Early' if ended_early else 'Completed'
-        db = get_database_connection()
+        db = get_database()
         try:
-            result = db.Rentals.update_one(
-                {
-                    'BossID': boss_id,
-                    'PlayerID': player_id,
-                    'Status': 'Accepted'
-                },
-                {
-                    '$set': {
-                        'Status': status,
-                        'ActualEndTime': end_time,
-                        'ActualDuration': actual_duration
+            # Completions due in the same moment share one bulk write; the read-back
+            # shows whether this worker's transition is the one that applied
+            rental = await db.write_buffer.submit(
+                'Rentals',
+                pymongo.UpdateOne(
+                    {'_id': rental_id, 'Status': 'Accepted'},
+                    {
+                        '$set': {
+                            'Status': status,
+                            'ActualEndTime': end_time,
+                            'ActualDuration': actual_duration,
+                            'CompletedBy': WORKER_ID
+                        }
                     }
-                }
+                ),
+                read_back=rental_id,
+                projection={'Status': 1, 'CompletedBy': 1, 'TotalPrice': 1, 'GuildID': 1}
             )
     
-            if result.modified_count == 0:
-                print(f"No rental found to complete for boss {boss_id} and player {player_id}")
+            if rental is None or rental['Status'] != status or rental.get('CompletedBy') != WORKER_ID:
+                print(f"Rental {rental_id} is no longer running; nothing to complete")
+                return
+
+            await record_rental_stats([(end_time, rental.get('GuildID'), boss_id, player_id, actual_duration, rental.get('TotalPrice', 0))])
         except PyMongoError as err:
             print(f"A database error occurred: {err}")
 
         channel = self.bot.get_channel(channel_id)
         if channel:
             if ended_early:
-                await channel.send(f"<@{boss_id}> <@{player_id}> Rental has ended early. Total duration: {actual_duration:.2f} hours.")
+                outbox.send(channel, f"<@{boss_id}> <@{player_id}> Rental has ended early. Total duration: {actual_duration:.2f} hours.", reason='completion')
             else:
-                await channel.send(f"<@{boss_id}> <@{player_id}> Rental has been completed. Total duration: {actual_duration:.2f} hours.")
+                outbox.send(channel, f"<@{boss_id}> <@{player_id}> Rental has been completed. Total duration: {actual_duration:.2f} hours.", reason='completion')
                 
-    @tasks.loop(minutes=1)
-    async def check_rentals(self):
+    def guild_ids(self):
+        # Rentals booked before GuildID was stored have none and may be run by any worker
+        return [guild.id for guild in self.bot.guilds] + [None]
+
+    @traced('rental_timer.recover')
+    async def recover(self):
+        """Rehydrate rentals from the Rentals collection after a restart.
+
+        Pending bookings get their Accept/Decline buttons re-registered, and
+        accepted bookings whose lease this worker can claim are adopted (see
+        :meth:`adopt`). Lease takeover in the heartbeat is enabled even if
+        recovery fails, so expired leases are still picked up later; database
+        errors are raised for the caller to retry.
+        """
+        db = get_database()
         now = datetime.now()
-        ended_rentals = []
+        try:
+            rentals = await db.Rentals.find(
+                {'Status': {'$in': ['Pending', 'Accepted']}, 'GuildID': {'$in': self.guild_ids()}},
+                RENTAL_RECOVERY_PROJECTION
+            )
+
+            accepted = []
+            for rental in rentals:
+                if rental['Status'] == 'Pending':
+                    self.bot.add_view(AcceptDeclineView(rental['BossID'], rental['PlayerID'], rental['RequestedDuration'],
+                                                        rental['RequestedStartTime'], rental['_id']))
+                else:
+                    accepted.append(rental)
+
+            adopted, finalized = await self.adopt(accepted, now)
+        finally:
+            self.recovered = True
+
+        print(f"Recovered {len(rentals) - len(accepted)} pending bookings and {adopted} rentals, finalized {finalized} overdue rentals")
 
-        for (boss_id, player_id), (end_time, channel_id, _) in self.active_rentals.items():
-            if now >= end_time:
-                ended_rentals.append((boss_id, player_id))
-                await self.end_rental(boss_id, player_id, end_time, ended_early=False)
+    async def claim(self, rentals, now):
+        """Take over every accepted rental in ``rentals`` that has no owner or whose owner's lease expired.
+
+        Each rental only changes hands if its ``LeaseOwner`` is still the one
+        read with it, so a worker that claimed it meanwhile keeps it. Returns
+        the ids this worker now holds.
+        """
+        if not rentals:
+            return set()
+        db = get_database()
+        live = await live_workers(now)
+        expired = {}
+        for rental in rentals:
+            owner = rental.get('LeaseOwner')
+            if owner != WORKER_ID and owner not in live:
+                expired.setdefault(owner, []).append(rental['_id'])
+        await asyncio.gather(*(
+            db.Rentals.update_many(
+                {'_id': {'$in': rental_ids}, 'Status': 'Accepted', 'LeaseOwner': owner},
+                {'$set': rental_lease()}
+            )
+            for owner, rental_ids in expired.items()
+        ))
+        claimed = await db.Rentals.find({'_id': {'$in': [rental['_id'] for rental in rentals]}, 'LeaseOwner': WORKER_ID}, {'_id': 1})
+        return {rental['_id'] for rental in claimed}
+
+    async def adopt(self, rentals, now):
+        """Claim and run accepted ``rentals``; returns ``(adopted, finalized)`` counts.
+
+        Rentals that have not started are queued again, running rentals are
+        re-scheduled with a persistent End Early button, and rentals whose end
+        time has passed are finalized in one bulk write.
+        """
+        claimed = await self.claim(rentals, now)
+
+        overdue = []
+        for rental in rentals:
+            if rental['_id'] not in claimed:
+                continue
+            boss_id, player_id = rental['BossID'], rental['PlayerID']
+            channel_id = rental.get('ChannelID')
+            if rental['_id'] in self.active_rentals:
+                # Already running here, e.g. adopted by an earlier recovery attempt
+                continue
+
+            if rental.get('ActualStartTime') is None:
+                self.schedule_start(rental['_id'], boss_id, player_id, rental['RequestedDuration'], channel_id,
+                                    rental['RequestedStartTime'], rental.get('ReminderSent', False))
+                continue
+
+            start_time = rental['ActualStartTime']
+            end_time = start_time + timedelta(hours=rental['RequestedDuration'])
+            if end_time <= now:
+                overdue.append((rental, end_time))
+                continue
+
+            self.active_rentals[rental['_id']] = (end_time, channel_id, start_time, boss_id, player_id)
+            self.schedule(end_time, 'end', rental['_id'])
+
+            view = EndEarlyView(boss_id, player_id, self, rental['_id'])
+            message_id = rental.get('ClockMessageID')
+            self.bot.add_view(view, message_id=message_id)
+            channel = self.bot.get_channel(channel_id) if channel_id else None
+            if channel and message_id:
+                self.track_clock(rental['_id'], channel.get_partial_message(message_id), view)
+
+        if overdue:
+            await self.finalize_overdue(overdue)
+
+        return len(claimed) - len(overdue), len(overdue)
+
+    @tasks.loop(seconds=5)
+    async def heartbeat(self):
+        try:
+            await self.renew_leases()
+            if self.recovered:
+                await self.take_over_expired()
+        except PyMongoError as err:
+            print(f"A database error occurred during the lease heartbeat: {err}")
+
+    async def renew_leases(self):
+        """Extend this worker's lease; after it lapsed, forget rentals other workers took over."""
+        db = get_database()
+        now = datetime.now()
+        previous = await db.Workers.find_one_and_update(
+            {'_id': WORKER_ID},
+            {'$set': {'LeaseExpiresAt': now + timedelta(seconds=self.lease_seconds)}},
+            upsert=True
+        )
+        if previous is None or previous['LeaseExpiresAt'] <= now:
+            # A worker that read the lapsed lease just before this renewal may still take rentals
+            # over, so ownership is checked again on the next heartbeat too
+            self._verify_leases = 2
+        if not self._verify_leases:
+            return
+        self._verify_leases -= 1
+
+        owned = list(self.active_rentals.keys() | self.scheduled_rentals.keys())
+        if not owned:
+            return
+        kept = await db.Rentals.find({'_id': {'$in': owned}, 'LeaseOwner': WORKER_ID}, {'_id': 1})
+        kept = {rental['_id'] for rental in kept}
+        for rental_id in owned:
+            if rental_id not in kept:
+                self.release(rental_id)
+
+    def release(self, rental_id):
+        """Forget a rental now run by another worker; its scheduler entries go stale."""
+        self.active_rentals.pop(rental_id, None)
+        self.scheduled_rentals.pop(rental_id, None)
+        clock = self.clock_messages.pop(rental_id, None)
+        if clock:
+            clock[1].stop()
+        print(f"Rental {rental_id} was taken over by another worker")
+
+    async def take_over_expired(self):
+        db = get_database()
+        now = datetime.now()
+        # Rentals of live workers (this one included) are not ours to take; the list is one id per worker
+        rentals = await db.Rentals.find(
+            {
+                'Status': 'Accepted',
+                'LeaseOwner': {'$nin': list(await live_workers(now) | {WORKER_ID})},
+                'GuildID': {'$in': self.guild_ids()}
+            },
+            RENTAL_RECOVERY_PROJECTION
+        )
+        if rentals:
+            adopted, finalized = await self.adopt(rentals, now)
+            if adopted or finalized:
+                print(f"Took over {adopted} rentals and finalized {finalized} overdue rentals from expired leases")
+
+    async def finalize_overdue(self, overdue):
+        """Complete rentals whose end time passed while nobody ran them.
+
+        Another worker (or the rental's own End Early) may complete some of
+        them first, so statistics and notices only cover the rentals this
+        worker's update actually completed.
+        """
+        db = get_database()
+        requests = [
+            pymongo.UpdateOne(
+                {'_id': rental['_id'], 'Status': 'Accepted'},
+                {'$set': {
+                    'Status': 'Completed',
+                    'ActualEndTime': end_time,
+                    'ActualDuration': (end_time - rental['ActualStartTime']).total_seconds() / 3600,
+                    'CompletedBy': WORKER_ID
+                }}
+            )
+            for rental, end_time in overdue
+        ]
+        try:
+            await db.Rentals.bulk_write(requests, ordered=False)
+            completed = await db.Rentals.find(
+                {'_id': {'$in': [rental['_id'] for rental, _ in overdue]}, 'Status': 'Completed', 'CompletedBy': WORKER_ID},
+                {'ActualEndTime': 1}
+            )
+            completed = {rental['_id']: rental['ActualEndTime'] for rental in completed}
+            # An End Early handled here also sets CompletedBy; our write is the one with this end time
+            # (stored at millisecond precision)
+            overdue = [
+                (rental, end_time) for rental, end_time in overdue
+                if rental['_id'] in completed and abs(completed[rental['_id']] - end_time) < timedelta(milliseconds=1)
+            ]
+            await record_rental_stats([
+                (end_time, rental.get('GuildID'), rental['BossID'], rental['PlayerID'],
+                 (end_time - rental['ActualStartTime']).total_seconds() / 3600, rental.get('TotalPrice', 0))
+                for rental, end_time in overdue
+            ])
+        except PyMongoError as err:
+            print(f"A database error occurred: {err}")
+            return
+
+        for rental, end_time in overdue:
+            channel_id = rental.get('ChannelID')
+            channel = self.bot.get_channel(channel_id) if channel_id else None
+            if not channel:
+                continue
+            actual_duration = (end_time - rental['ActualStartTime']).total_seconds() / 3600
+            if rental.get('ClockMessageID'):
+                outbox.edit(channel.get_partial_message(rental['ClockMessageID']), content="Rental time has ended!", view=None,
+                            priority=outbound.NOTICE, reason='clock_closed')
+            outbox.send(channel, f"<@{rental['BossID']}> <@{rental['PlayerID']}> Rental has been completed. Total duration: {actual_duration:.2f} hours.", reason='completion')
 
     def cog_unload(self):
-        self.check_rentals.cancel()
+        if self._scheduler_task:
+            self._scheduler_task.cancel()
+        self.refresh_clocks.cancel()
+        self.heartbeat.cancel()
 
 class EndEarlyView(nextcord.ui.View):
-    def __init__(self, boss_id, player_id, rental_timer):
+    def __init__(self, boss_id, player_id, rental_timer, rental_id):
         super().__init__(timeout=None)
         self.boss_id = boss_id
         self.player_id = player_id
         self.rental_timer = rental_timer
+        self.rental_id = rental_id
+
+        end_early_button = nextcord.ui.Button(label="End Early", style=nextcord.ButtonStyle.danger, custom_id=f"rental:{rental_id}:end_early")
+        end_early_button.callback = self.end_early
+        self.add_item(end_early_button)
 
-    @nextcord.ui.button(label="End Early", style=nextcord.ButtonStyle.danger)
-    async def end_early(self, button: nextcord.ui.Button, interaction: nextcord.Interaction):
+    @traced('end_early')
+    @once_per_interaction
+    async def end_early(self, interaction: nextcord.Interaction):
         if str(interaction.user.id) != self.player_id:
             await interaction.response.send_message("Only the player can end the rental early.", ephemeral=True)
             return
 
-        await self.rental_timer.end_rental(self.boss_id, self.player_id, datetime.now(), ended_early=True)
-        await interaction.response.send_message("Rental ended early.")
+        async with self.rental_timer.lock(self.rental_id):
+            if self.rental_id not in self.rental_timer.active_rentals:
+                await interaction.response.send_message("This rental has already ended.", ephemeral=True)
+                return
+
+            if not await interaction_dedupe.confirm(interaction.id):
+                return
+            await interaction.response.send_message("Rental ended early.")
+            await self.rental_timer.end_rental(self.rental_id, datetime.now(), ended_early=True)
         self.stop()
         
 # In your bot setup
 bot.rental_timer = RentalTimer(bot)
+health_server = HealthServer(bot, database)
+
+metrics.ACTIVE_RENTALS.set_function(lambda: len(bot.rental_timer.active_rentals))
+metrics.SCHEDULED_RENTALS.set_function(lambda: len(bot.rental_timer.scheduled_rentals))
+metrics.OUTBOUND_BACKLOG.set_function(lambda: outbox.backlog())
+
+@bot.listen('on_interaction')
+async def count_interaction(interaction):
+    metrics.INTERACTIONS.inc(type=interaction.type.name)
+
+# Milliseconds spent in each startup phase, reported by /healthz and the metrics endpoint
+bot.startup_timings = {}
+bot.startup_task = None
+
+def record_startup_phase(name, elapsed):
+    bot.startup_timings[name] = round(elapsed * 1000, 1)
+    metrics.STARTUP_PHASE_SECONDS.set(elapsed, phase=name)
+
+async def timed_phase(name, coro):
+    started = time.perf_counter()
+    try:
+        return await coro
+    finally:
+        record_startup_phase(name, time.perf_counter() - started)
+
+async def with_retries(name, func):
+    """Await ``func()``, retrying with backoff while the database is unreachable.
+
+    Only connection errors (including server selection timeouts) are
+    retried; any other database error is permanent and raised at once.
+    """
+    delay = 1
+    while True:
+        try:
+            return await func()
+        except ConnectionFailure as err:
+            print(f"A database error occurred during {name}: {err}; retrying in {delay}s")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, STARTUP_RETRY_MAX_SECONDS)
+
+async def startup():
+    """Bring the database schema up to date, then restore rentals.
+
+    Runs once per process in the background after the gateway is ready, so
+    neither a slow database nor index builds delay the bot coming online.
+    Recovery waits for the schema step: a migration's backfills and rollup
+    rebuilds must not race rentals being adopted and finalized. On a warm
+    restart the schema step is a single read. The lease heartbeat starts
+    first, so leases taken by rentals accepted meanwhile are renewed however
+    long the schema step or recovery take, or if they fail.
+    """
+    started = time.perf_counter()
+    if not bot.rental_timer.heartbeat.is_running():
+        detached(bot.rental_timer.heartbeat.start)
+    try:
+        schema = await timed_phase('schema', with_retries('schema setup', setup_mongodb))
+    except Exception as e:
+        print(f"An error occurred during schema setup: {e}")
+    else:
+        if not schema:
+            print(f"Database schema is at version {SCHEMA_VERSION}; skipped setup")
+    try:
+        await timed_phase('recover', with_retries('rental recovery', bot.rental_timer.recover))
+    except Exception as e:
+        print(f"An error occurred during rental recovery: {e}")
+    if not rental_lifecycle.is_running():
+        rental_lifecycle.start()
+    record_startup_phase('total', time.perf_counter() - STARTED_AT)
+    print(f"Startup finished in {time.perf_counter() - started:.2f}s after ready: {bot.startup_timings}")
 
 @bot.event
 async def on_ready():
     print(f'We have logged in as {bot.user}')
+    if bot.startup_task is None:
+        record_startup_phase('gateway', time.perf_counter() - STARTED_AT)
+
+    started = time.perf_counter()
     for guild in bot.guilds:
         print(f"Connected to guild: {guild.name} (id: {guild.id})")
         print(f"Member count: {guild.member_count}")
+        member_index.build(guild)
+    # Loaded ahead of the first click, since button responses that open a modal cannot wait for it
+    detached(asyncio.create_task, guild_settings.load(bot.guilds))
+
+    # on_ready fires again after reconnects; only run startup once
+    if bot.startup_task is None:
+        record_startup_phase('member_index', time.perf_counter() - started)
+        bot.startup_task = asyncio.create_task(startup())
 
-# Alive
-app = Flask('')
+@bot.event
+async def on_guild_join(guild):
+    member_index.build(guild)
+    guild_settings.prefetch(guild)
 
-@app.route('/')
-def home():
-    return "I'm alive"
+@bot.event
+async def on_member_join(member):
+    member_index.add(member)
 
-def run():
-    port = int(os.environ.get('PORT', 8080))
-    app.run(host='0.0.0.0', port=port)
-    print(f"Flask app is running on port {port}")
+@bot.event
+async def on_member_update(before, after):
+    if before.display_name != after.display_name:
+        member_index.add(after)
 
-def keep_alive():
-    def run():
-        port = int(os.environ.get('PORT', 8080))
-        app.run(host='0.0.0.0', port=port)
-        print(f"Flask app is running on port {port}")
-    
-    server = Thread(target=run)
-    server.start()
-    print("Keep alive thread started")
+@bot.event
+async def on_user_update(before, after):
+    # Username changes are reported per user, not per guild
+    if before.name == after.name:
+        return
+    for guild in bot.guilds:
+        member = guild.get_member(after.id)
+        if member:
+            member_index.add(member)
 
-# Call this function before running the bot
-keep_alive()
+@bot.event
+async def on_member_remove(member):
+    member_index.remove(member)
 
 # Run the bot
 if __name__ == "__main__":
-    keep_alive()
-    bot.run(TOKEN)
+    # Serve /healthz and /metrics from the bot's own event loop
+    bot.loop.create_task(health_server.start())
+    try:
+        bot.run(TOKEN)
+    finally:
+        close_database()
+
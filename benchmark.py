@@ -0,0 +1,381 @@
+"""Offline load test for RentDuoer.
+
+Drives the real modals, views and RentalTimer with fake Discord objects and
+an in-memory MongoDB (mongomock) or a local mongod, then reports throughput,
+event loop lag, Mongo operations per booking, outbound Discord API calls and
+the cost of redelivered interactions.
+
+    pip install mongomock
+    python benchmark.py --players 200 --bookings 2000 --concurrency 100
+    python benchmark.py --mongo-uri mongodb://localhost:27017 --database BenchBot
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+import db_connection
+
+
+class ApiCalls:
+    """Counts every outbound call the bot makes to the fake Discord API."""
+
+    def __init__(self):
+        self.counts = {}
+
+    def record(self, kind):
+        self.counts[kind] = self.counts.get(kind, 0) + 1
+
+    def total(self):
+        return sum(self.counts.values())
+
+
+API_CALLS = ApiCalls()
+_ids = itertools.count(10 ** 17)
+
+
+class FakeMessage:
+    def __init__(self, channel, content, view=None):
+        self.id = next(_ids)
+        self.channel = channel
+        self.content = content
+        self.view = view
+
+    async def edit(self, content=None, view=None, **kwargs):
+        API_CALLS.record('message.edit')
+        self.content = content
+        self.view = view
+
+
+class FakeChannel:
+    def __init__(self, channel_id, guild=None):
+        self.id = channel_id
+        self.guild = guild
+        self.messages = {}
+
+    async def send(self, content=None, view=None, **kwargs):
+        API_CALLS.record('channel.send')
+        message = FakeMessage(self, content, view)
+        self.messages[message.id] = message
+        return message
+
+    def get_partial_message(self, message_id):
+        return self.messages.get(message_id) or FakeMessage(self, None)
+
+
+class FakeRole:
+    def __init__(self, role_id, name):
+        self.id = role_id
+        self.name = name
+
+
+class FakeMember:
+    def __init__(self, member_id, name, guild, roles=()):
+        self.id = member_id
+        self.name = name
+        self.display_name = name
+        self.guild = guild
+        self.roles = list(roles)
+        self.bot = False
+
+    async def send(self, content=None, view=None, **kwargs):
+        API_CALLS.record('member.send')
+        return FakeMessage(None, content, view)
+
+
+class FakeGuild:
+    def __init__(self, guild_id):
+        self.id = guild_id
+        self.name = 'Benchmark Guild'
+        self.members = []
+        self.roles = []
+        self._members = {}
+
+    @property
+    def member_count(self):
+        return len(self.members)
+
+    def add_member(self, member):
+        self.members.append(member)
+        self._members[member.id] = member
+
+    def get_member(self, member_id):
+        return self._members.get(member_id)
+
+    def get_role(self, role_id):
+        return next((role for role in self.roles if role.id == role_id), None)
+
+    async def query_members(self, query, limit=5):
+        API_CALLS.record('guild.query_members')
+        return []
+
+
+class FakeResponse:
+    def __init__(self):
+        self._done = False
+
+    def is_done(self):
+        return self._done
+
+    async def defer(self, **kwargs):
+        API_CALLS.record('response.defer')
+        self._done = True
+
+    async def send_message(self, content=None, **kwargs):
+        API_CALLS.record('response.send_message')
+        self._done = True
+
+    async def send_modal(self, modal):
+        API_CALLS.record('response.send_modal')
+        self._done = True
+
+    async def edit_message(self, **kwargs):
+        API_CALLS.record('response.edit_message')
+        self._done = True
+
+
+class FakeFollowup:
+    async def send(self, content=None, **kwargs):
+        API_CALLS.record('followup.send')
+
+
+class FakeInteraction:
+    def __init__(self, user, channel):
+        self.id = next(_ids)
+        self.user = user
+        self.channel = channel
+        self.guild = channel.guild
+        self.guild_id = channel.guild.id
+        self.response = FakeResponse()
+        self.followup = FakeFollowup()
+
+
+def fill(modal, **values):
+    """Set the submitted values of a modal's text inputs."""
+    for field, value in values.items():
+        getattr(modal, field)._inputed_value = value
+
+
+class LoopLagProbe:
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.samples = []
+        self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(self.interval)
+            self.samples.append(max(loop.time() - started - self.interval, 0.0))
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+
+    def summary(self):
+        values = sorted(self.samples) or [0.0]
+        return {
+            'max_ms': round(values[-1] * 1000, 2),
+            'p99_ms': round(values[min(len(values) - 1, int(len(values) * 0.99))] * 1000, 2),
+        }
+
+
+async def run_phase(name, coroutines, concurrency, report):
+    """Run ``coroutines`` with bounded concurrency and record phase statistics."""
+    import metrics
+
+    semaphore = asyncio.Semaphore(concurrency)
+    probe = LoopLagProbe()
+    mongo_ops = metrics.MONGO_LATENCY.count()
+    api_calls = API_CALLS.total()
+
+    async def limited(coro):
+        async with semaphore:
+            await coro
+
+    probe.start()
+    started = time.perf_counter()
+    await asyncio.gather(*(limited(coro) for coro in coroutines))
+    elapsed = time.perf_counter() - started
+    await probe.stop()
+
+    report[name] = {
+        'interactions': len(coroutines),
+        'seconds': round(elapsed, 3),
+        'interactions_per_sec': round(len(coroutines) / elapsed, 1) if elapsed else None,
+        'mongo_ops': metrics.MONGO_LATENCY.count() - mongo_ops,
+        'discord_api_calls': API_CALLS.total() - api_calls,
+        'loop_lag': probe.summary(),
+    }
+    return report[name]
+
+
+async def benchmark(args):
+    import metrics
+    import RentDuoer
+
+    bot = RentDuoer.bot
+    guild = FakeGuild(next(_ids))
+    # Bookings are spread over several channels so per-channel rate limits apply realistically
+    channels = {channel.id: channel for channel in (FakeChannel(next(_ids), guild) for _ in range(args.channels))}
+    channel_list = list(channels.values())
+    channel = channel_list[0]
+    bot.get_channel = channels.get
+
+    players = [FakeMember(next(_ids), f'player{i}', guild) for i in range(args.players)]
+    bosses = [FakeMember(next(_ids), f'boss{i}', guild) for i in range(args.bosses)]
+    for member in players + bosses:
+        guild.add_member(member)
+    RentDuoer.member_index.build(guild)
+
+    report = {}
+
+    # Cold schema setup, then a warm restart that should skip it
+    for name in ('schema_cold', 'schema_warm'):
+        started = time.perf_counter()
+        applied = await RentDuoer.setup_mongodb()
+        report[name] = {'seconds': round(time.perf_counter() - started, 3), 'applied': applied}
+
+    # Register every player
+    async def register(player):
+        modal = RentDuoer.RegisterModal()
+        fill(modal, personal_info=f'{player.name}, 01/01/2000, Hanoi, yes', price='100K',
+             social_link='https://example.com', talent='Singing', games='League of Legends, Valorant')
+        await modal.callback(FakeInteraction(player, channel))
+
+    await run_phase('register', [register(player) for player in players], args.concurrency, report)
+
+    # Book each player in distinct past minutes so bookings never overlap and
+    # accepted rentals start immediately
+    now = datetime.now().replace(second=0, microsecond=0)
+    rental_hours = args.rental_seconds / 3600
+    bookings = []
+    for i in range(args.bookings):
+        player = players[i % len(players)]
+        boss = bosses[i % len(bosses)]
+        start = now - timedelta(minutes=1 + i // len(players))
+        bookings.append((boss, player, start))
+
+    async def book(index, boss, player, start):
+        modal = RentDuoer.BookingModal()
+        fill(modal, boss_username=boss.name, player_name=player.name,
+             rent_hours=f'{rental_hours:.6f}', rent_time=start.strftime('%d/%m/%Y %H:%M'))
+        await modal.callback(FakeInteraction(boss, channel_list[index % len(channel_list)]))
+
+    phase = await run_phase('booking', [book(i, *booking) for i, booking in enumerate(bookings)], args.concurrency, report)
+    await RentDuoer.outbox.drain(args.settle_seconds)
+    phase['mongo_ops_per_booking'] = round(phase['mongo_ops'] / max(len(bookings), 1), 2)
+
+    # Accept every pending booking through its view
+    views = [
+        (message.view, message.channel) for message in itertools.chain.from_iterable(c.messages.values() for c in channel_list)
+        if isinstance(message.view, RentDuoer.AcceptDeclineView)
+    ]
+
+    accepted = []
+
+    async def accept(view, view_channel):
+        player = guild.get_member(int(view.player_id))
+        interaction = FakeInteraction(player, view_channel)
+        accepted.append((view, interaction))
+        await view.accept(interaction)
+
+    await run_phase('accept', [accept(*item) for item in views], args.concurrency, report)
+    report['accept']['active_rentals'] = len(bot.rental_timer.active_rentals)
+
+    # Redeliver every accept interaction, as Discord does when a response is slow;
+    # duplicates should cost no database writes or API calls
+    phase = await run_phase('redelivery', [view.accept(interaction) for view, interaction in accepted], args.concurrency, report)
+    phase['suppressed'] = metrics.DUPLICATES_SUPPRESSED.value(kind='interaction')
+
+    # Let the running rentals reach their end time and complete
+    probe = LoopLagProbe()
+    probe.start()
+    api_calls = API_CALLS.total()
+    mongo_ops = metrics.MONGO_LATENCY.count()
+    started = time.perf_counter()
+    deadline = started + args.rental_seconds + args.settle_seconds
+    while bot.rental_timer.active_rentals and time.perf_counter() < deadline:
+        await asyncio.sleep(0.1)
+    while bot.rental_timer._pending_tasks and time.perf_counter() < deadline:
+        await asyncio.sleep(0.1)
+    await RentDuoer.outbox.drain(max(deadline - time.perf_counter(), 0))
+    elapsed = time.perf_counter() - started
+    await probe.stop()
+    report['completion'] = {
+        'seconds': round(elapsed, 3),
+        'still_active': len(bot.rental_timer.active_rentals),
+        'outbound_backlog': RentDuoer.outbox.backlog(),
+        'outbound_shed': sum(value for _, _, value in metrics.OUTBOUND_SHED.samples()),
+        'mongo_ops': metrics.MONGO_LATENCY.count() - mongo_ops,
+        'discord_api_calls': API_CALLS.total() - api_calls,
+        'loop_lag': probe.summary(),
+    }
+
+    total_seconds = sum(phase.get('seconds', 0) for phase in report.values())
+    report['discord_api'] = {
+        'calls': dict(sorted(API_CALLS.counts.items())),
+        'calls_per_minute': round(API_CALLS.total() / total_seconds * 60, 1) if total_seconds else None,
+    }
+
+    bot.rental_timer.cog_unload()
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--players', type=int, default=100)
+    parser.add_argument('--bosses', type=int, default=100)
+    parser.add_argument('--bookings', type=int, default=1000)
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--channels', type=int, default=20, help='Booking channels to spread requests over')
+    parser.add_argument('--rental-seconds', type=float, default=2.0, help='Duration of each simulated rental')
+    parser.add_argument('--settle-seconds', type=float, default=10.0, help='Extra time allowed for completions')
+    parser.add_argument('--clock-refresh', type=int, default=0, help='RENTAL_CLOCK_REFRESH_SECONDS for the run')
+    parser.add_argument('--mongo-uri', help='Use a real mongod instead of mongomock')
+    parser.add_argument('--database', default='RentDuoerBenchmark', help='Database name when using --mongo-uri')
+    parser.add_argument('--json', action='store_true', help='Print the report as JSON')
+    args = parser.parse_args()
+
+    os.environ['RENTAL_CLOCK_REFRESH_SECONDS'] = str(args.clock_refresh)
+    os.environ['RENTAL_REMINDER_MINUTES'] = '0'
+
+    # The shared database must exist before RentDuoer is imported
+    if args.mongo_uri:
+        database = db_connection.init_database(args.mongo_uri, name=args.database)
+        database.client.drop_database(args.database)
+    else:
+        try:
+            import mongomock
+        except ImportError:
+            sys.exit("mongomock is required for offline benchmarks: pip install mongomock")
+        db_connection.init_database(client=mongomock.MongoClient())
+
+    try:
+        report = asyncio.run(benchmark(args))
+    finally:
+        db_connection.close_database()
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+
+    for name, phase in report.items():
+        print(f"[{name}]")
+        for key, value in phase.items():
+            print(f"  {key}: {value}")
+
+
+if __name__ == '__main__':
+    main()
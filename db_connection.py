@@ -1,12 +1,330 @@
+import asyncio
+import functools
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
 import pymongo
 from dotenv import load_dotenv
-import os
+from pymongo.errors import BulkWriteError, PyMongoError
+
+import metrics
+import tracing
 
 load_dotenv()
 
+DATABASE_NAME = 'BotDiscord'
+
+# Pool and timeout settings, overridable from the environment
+MAX_POOL_SIZE = int(os.getenv('MONGO_MAX_POOL_SIZE', 20))
+MIN_POOL_SIZE = int(os.getenv('MONGO_MIN_POOL_SIZE', 0))
+SERVER_SELECTION_TIMEOUT_MS = int(os.getenv('MONGO_SERVER_SELECTION_TIMEOUT_MS', 5000))
+CONNECT_TIMEOUT_MS = int(os.getenv('MONGO_CONNECT_TIMEOUT_MS', 5000))
+SOCKET_TIMEOUT_MS = int(os.getenv('MONGO_SOCKET_TIMEOUT_MS', 10000))
+
+# Buffered writes are flushed this long after the first one is queued, or once this many are queued
+WRITE_BUFFER_INTERVAL_MS = int(os.getenv('MONGO_WRITE_BUFFER_INTERVAL_MS', 50))
+WRITE_BUFFER_MAX_BATCH = int(os.getenv('MONGO_WRITE_BUFFER_MAX_BATCH', 500))
+
+# Cursor-returning methods whose results are materialised inside the worker thread
+_CURSOR_METHODS = {'find', 'aggregate', 'list_indexes'}
+
+# Methods traced as the 'db_read' stage; everything else counts as 'db_write'
+_READ_METHODS = _CURSOR_METHODS | {'find_one', 'count_documents', 'estimated_document_count', 'distinct'}
+
+
+class AsyncCollection:
+    """Awaitable proxy around a pymongo collection.
+
+    Every method call is executed on the database thread pool so blocking
+    network round-trips never run on the event loop. Cursor-returning methods
+    (``find``, ``aggregate``) are drained into a list inside the worker thread.
+    Each call's latency is recorded in :data:`metrics.MONGO_LATENCY` and as a
+    ``db_read``/``db_write`` stage of the current trace span.
+    """
+
+    def __init__(self, database, collection):
+        self._database = database
+        self._collection = collection
+
+    @property
+    def sync(self):
+        return self._collection
+
+    def __getattr__(self, name):
+        method = getattr(self._collection, name)
+        if not callable(method):
+            return method
+
+        if name in _CURSOR_METHODS:
+            def call(*args, **kwargs):
+                return list(method(*args, **kwargs))
+        else:
+            call = method
+
+        @functools.wraps(method)
+        async def run(*args, **kwargs):
+            return await self.run_operation(name, call, *args, **kwargs)
+
+        return run
+
+    async def run_operation(self, operation, call, /, *args, **kwargs):
+        """Run the blocking ``call`` on the thread pool, measured as ``operation`` of this collection."""
+        started = time.perf_counter()
+        try:
+            with tracing.stage('db_read' if operation in _READ_METHODS else 'db_write'):
+                return await self._database.run(call, *args, **kwargs)
+        except PyMongoError:
+            metrics.MONGO_ERRORS.inc(collection=self._collection.name, operation=operation)
+            raise
+        finally:
+            metrics.MONGO_LATENCY.observe(time.perf_counter() - started, collection=self._collection.name, operation=operation)
+
+
+class _Batch:
+    __slots__ = ('name', 'items', 'started')
+
+    def __init__(self, name, items):
+        self.name = name
+        self.items = items
+        # Set on the pool thread once bulk_write is called; until then the batch may still be lost to cancellation
+        self.started = False
+
+
+class _BufferedWrite:
+    __slots__ = ('request', 'future', 'read_back', 'projection')
+
+    def __init__(self, request, future, read_back, projection):
+        self.request = request
+        self.future = future
+        self.read_back = read_back
+        self.projection = projection
+
+
+class WriteBuffer:
+    """Write-behind buffer that groups single-document writes into ``bulk_write`` batches.
+
+    :meth:`submit` queues a pymongo write request (``UpdateOne``,
+    ``InsertOne``...) and returns a future. Queued writes are flushed one
+    unordered ``bulk_write`` per collection ``interval`` seconds after the
+    first write is queued, or as soon as ``max_batch`` are queued. The future
+    resolves to the batch's ``BulkWriteResult``, or, when ``read_back`` names
+    a document ``_id``, to that document as read after the batch (one ``find``
+    per batch), so callers can tell whether their conditional update applied.
+
+    Taken batches stay in an in-flight registry until their ``bulk_write``
+    has started on the database thread pool. Writes still queued, and batches
+    whose flush task or pool job was cancelled before starting (as happens
+    when the event loop shuts down), are written synchronously by
+    :meth:`flush_sync` when the database is closed, so stopping the bot does
+    not lose them.
+    """
+
+    def __init__(self, database, interval=WRITE_BUFFER_INTERVAL_MS / 1000, max_batch=WRITE_BUFFER_MAX_BATCH):
+        self._database = database
+        self.interval = interval
+        self.max_batch = max_batch
+        self._pending = {}
+        self._size = 0
+        self._timer = None
+        self._flushes = set()
+        self._in_flight = []
+
+    def submit(self, collection, request, *, read_back=None, projection=None):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.setdefault(collection, []).append(_BufferedWrite(request, future, read_back, projection))
+        self._size += 1
+
+        if self._size >= self.max_batch:
+            self._start_flush()
+        elif self._timer is None:
+            self._timer = tracing.detached(loop.call_later, self.interval, self._start_flush)
+        return future
+
+    def _take(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batches = [_Batch(name, items) for name, items in self._pending.items()]
+        self._pending, self._size = {}, 0
+        self._in_flight.extend(batches)
+        return batches
+
+    def _start_flush(self):
+        # A batch mixes writes from many callbacks; none of their spans is charged for it
+        task = tracing.detached(asyncio.create_task, self._flush(self._take()))
+        self._flushes.add(task)
+        task.add_done_callback(self._flushes.discard)
+
+    async def flush(self):
+        """Write everything queued so far and wait for in-flight batches."""
+        await self._flush(self._take())
+        if self._flushes:
+            await asyncio.gather(*self._flushes, return_exceptions=True)
+
+    async def _flush(self, batches):
+        await asyncio.gather(*(self._write(batch) for batch in batches))
+
+    async def _write(self, batch):
+        name, items = batch.name, batch.items
+        collection = self._database.collection(name)
+        metrics.WRITE_BATCH_SIZE.observe(len(items), collection=name)
+
+        def bulk_write(requests):
+            batch.started = True
+            return collection.sync.bulk_write(requests, ordered=False)
+
+        failed = {}
+        result = None
+        try:
+            result = await collection.run_operation('bulk_write', bulk_write, [item.request for item in items])
+        except BulkWriteError as e:
+            # Unordered: everything but the reported requests was applied
+            for error in e.details.get('writeErrors', []):
+                failed[error['index']] = e
+            print(f"Buffered write errors in {name}: {len(failed)} of {len(items)} requests failed")
+        except PyMongoError as e:
+            print(f"A database error occurred while flushing {len(items)} buffered writes to {name}: {e}")
+            failed = dict.fromkeys(range(len(items)), e)
+        finally:
+            if batch.started:
+                self._in_flight.remove(batch)
+
+        documents = {}
+        read_back = [index for index, item in enumerate(items) if item.read_back is not None and index not in failed]
+        if read_back:
+            projection = {}
+            for index in read_back:
+                projection.update(items[index].projection or {})
+            try:
+                found = await collection.find({'_id': {'$in': [items[index].read_back for index in read_back]}}, projection or None)
+                documents = {document['_id']: document for document in found}
+            except PyMongoError as e:
+                print(f"A database error occurred while reading back buffered writes to {name}: {e}")
+                failed.update(dict.fromkeys(read_back, e))
+
+        for index, item in enumerate(items):
+            if item.future.done():
+                continue
+            if index in failed:
+                item.future.set_exception(failed[index])
+            elif item.read_back is not None:
+                item.future.set_result(documents.get(item.read_back))
+            else:
+                item.future.set_result(result)
+
+    def flush_sync(self):
+        """Write queued and never-started batches with blocking calls.
+
+        Used at shutdown, after the thread pool has finished its jobs, when the
+        event loop may be gone.
+        """
+        self._take()
+        batches = [batch for batch in self._in_flight if not batch.started]
+        self._in_flight = []
+        for batch in batches:
+            try:
+                self._database.sync[batch.name].bulk_write([item.request for item in batch.items], ordered=False)
+            except PyMongoError as e:
+                print(f"A database error occurred while flushing {len(batch.items)} buffered writes to {batch.name} at shutdown: {e}")
+
+
+class Database:
+    """Long-lived MongoDB access layer shared by every callback.
+
+    Owns a single ``MongoClient`` (and therefore a single connection pool) and
+    a thread pool sized to match it, and exposes collections as
+    :class:`AsyncCollection` objects, e.g. ``await db.Rentals.find_one(...)``.
+    """
+
+    def __init__(self, uri=None, name=DATABASE_NAME, *, client=None,
+                 max_pool_size=MAX_POOL_SIZE, min_pool_size=MIN_POOL_SIZE,
+                 server_selection_timeout_ms=SERVER_SELECTION_TIMEOUT_MS,
+                 connect_timeout_ms=CONNECT_TIMEOUT_MS,
+                 socket_timeout_ms=SOCKET_TIMEOUT_MS):
+        if client is None:
+            client = pymongo.MongoClient(
+                uri,
+                maxPoolSize=max_pool_size,
+                minPoolSize=min_pool_size,
+                serverSelectionTimeoutMS=server_selection_timeout_ms,
+                connectTimeoutMS=connect_timeout_ms,
+                socketTimeoutMS=socket_timeout_ms,
+            )
+        self.client = client
+        self.sync = client[name]
+        self._executor = ThreadPoolExecutor(max_workers=max_pool_size, thread_name_prefix='mongo')
+        self._collections = {}
+        self._closed = False
+        self.write_buffer = WriteBuffer(self)
+
+    async def run(self, func, *args, **kwargs):
+        """Run a blocking pymongo call on the database thread pool."""
+        if self._closed:
+            raise RuntimeError("Database connection has been closed")
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(func, *args, **kwargs))
+
+    def collection(self, name):
+        if name not in self._collections:
+            self._collections[name] = AsyncCollection(self, self.sync[name])
+        return self._collections[name]
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return self.collection(name)
+
+    def __getitem__(self, name):
+        return self.collection(name)
+
+    async def command(self, *args, **kwargs):
+        return await self.run(self.sync.command, *args, **kwargs)
+
+    async def list_collection_names(self):
+        return await self.run(self.sync.list_collection_names)
+
+    async def create_collection(self, name, **kwargs):
+        return await self.run(self.sync.create_collection, name, **kwargs)
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        # Batches already handed to the pool finish first, then whatever is still queued
+        self._executor.shutdown(wait=True)
+        self.write_buffer.flush_sync()
+        self.client.close()
+
+
+_database = None
+
+
+def init_database(uri=None, **kwargs):
+    """Create the shared :class:`Database`. Call once at startup."""
+    global _database
+    if _database is None:
+        _database = Database(uri or os.getenv('mongoURI'), **kwargs)
+    return _database
+
+
+def get_database():
+    """Return the shared :class:`Database`, creating it on first use."""
+    return init_database()
+
+
+def close_database():
+    global _database
+    if _database is not None:
+        _database.close()
+        _database = None
+
+
 def get_database_connection():
-    client = pymongo.MongoClient(os.getenv('mongoURI'))
-    return client.BotDiscord
+    # Kept for scripts that want the synchronous handle; reuses the shared pool
+    return get_database().sync
+
 
-def close_database_connection(client):
-    client.close()
\ No newline at end of file
+def close_database_connection(client=None):
+    close_database()
@@ -0,0 +1,100 @@
+import asyncio
+import json
+import math
+import os
+import time
+
+from aiohttp import web
+
+import metrics
+
+HEALTH_HOST = os.getenv('HEALTH_HOST', '0.0.0.0')
+HEALTH_PORT = int(os.getenv('PORT', 8080))
+
+# Seconds between event loop lag probes
+LOOP_LAG_INTERVAL = 1.0
+
+
+class HealthServer:
+    """HTTP health and metrics endpoint served from the bot's own event loop.
+
+    ``/`` answers keep-alive pings, ``/healthz`` reports gateway latency, a
+    Mongo ping and event loop lag as JSON, and ``/metrics`` exposes the
+    counters in :mod:`metrics` in the Prometheus text format.
+    """
+
+    def __init__(self, bot, database, host=HEALTH_HOST, port=HEALTH_PORT):
+        self.bot = bot
+        self.database = database
+        self.host = host
+        self.port = port
+        self._runner = None
+        self._lag_task = None
+
+    async def start(self):
+        if self._runner is not None:
+            return
+        app = web.Application()
+        app.router.add_get('/', self.home)
+        app.router.add_get('/healthz', self.healthz)
+        app.router.add_get('/metrics', self.metrics)
+
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        self._lag_task = asyncio.create_task(self._measure_loop_lag())
+        print(f"Health server is running on port {self.port}")
+
+    async def stop(self):
+        if self._lag_task:
+            self._lag_task.cancel()
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def _measure_loop_lag(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(LOOP_LAG_INTERVAL)
+            metrics.LOOP_LAG.set(max(loop.time() - started - LOOP_LAG_INTERVAL, 0.0))
+
+    def gateway_latency(self):
+        latency = self.bot.latency
+        return latency if math.isfinite(latency) else None
+
+    async def home(self, request):
+        return web.Response(text="I'm alive")
+
+    async def healthz(self, request):
+        body = {
+            'discord_ready': self.bot.is_ready(),
+            'gateway_latency_ms': None,
+            'mongo_ping_ms': None,
+            'loop_lag_ms': round(metrics.LOOP_LAG.value() * 1000, 2),
+            'active_rentals': metrics.ACTIVE_RENTALS.value(),
+            'startup_ms': getattr(self.bot, 'startup_timings', None),
+        }
+        latency = self.gateway_latency()
+        if latency is not None:
+            body['gateway_latency_ms'] = round(latency * 1000, 2)
+
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(self.database.command('ping'), timeout=2)
+            body['mongo_ping_ms'] = round((time.perf_counter() - started) * 1000, 2)
+        except Exception as e:
+            body['mongo_error'] = str(e)
+
+        healthy = body['discord_ready'] and body['mongo_ping_ms'] is not None
+        body['status'] = 'ok' if healthy else 'degraded'
+        return web.Response(text=json.dumps(body), status=200 if healthy else 503, content_type='application/json')
+
+    async def metrics(self, request):
+        latency = self.gateway_latency()
+        if latency is not None:
+            metrics.GATEWAY_LATENCY.set(latency)
+        return web.Response(
+            body=metrics.render().encode('utf-8'),
+            headers={'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+        )
@@ -0,0 +1,150 @@
+import bisect
+import threading
+
+# Default latency buckets in seconds
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    pairs = ','.join(f'{key}="{str(value)}"' for key, value in labels)
+    return '{' + pairs + '}'
+
+
+class Metric:
+    """Base class for the small in-process Prometheus metrics below.
+
+    Metrics register themselves in ``registry`` and are rendered in the
+    Prometheus text exposition format by :func:`render`. Updates may come from
+    the database thread pool, so they are guarded by a lock.
+    """
+
+    type = 'untyped'
+
+    def __init__(self, name, documentation, registry=None):
+        self.name = name
+        self.documentation = documentation
+        self._lock = threading.Lock()
+        (registry if registry is not None else REGISTRY).append(self)
+
+    def samples(self):
+        raise NotImplementedError
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.type}']
+        for suffix, labels, value in self.samples():
+            lines.append(f'{self.name}{suffix}{_format_labels(labels)} {value}')
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def __init__(self, name, documentation, registry=None):
+        super().__init__(name, documentation, registry)
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(tuple(sorted(labels.items())), 0)
+
+    def samples(self):
+        with self._lock:
+            return [('', labels, value) for labels, value in self._values.items()]
+
+
+class Gauge(Metric):
+    type = 'gauge'
+
+    def __init__(self, name, documentation, registry=None):
+        super().__init__(name, documentation, registry)
+        self._values = {}
+        self._function = None
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[tuple(sorted(labels.items()))] = value
+
+    def set_function(self, function):
+        """Compute the gauge lazily from ``function()`` at scrape time."""
+        self._function = function
+
+    def value(self, **labels):
+        if self._function is not None:
+            return self._function()
+        return self._values.get(tuple(sorted(labels.items())), 0)
+
+    def samples(self):
+        if self._function is not None:
+            return [('', (), self._function())]
+        with self._lock:
+            return [('', labels, value) for labels, value in self._values.items()]
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, documentation, buckets=DEFAULT_BUCKETS, registry=None):
+        super().__init__(name, documentation, registry)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            counts, total = self._series.get(key, ([0] * (len(self.buckets) + 1), 0.0))
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            self._series[key] = (counts, total + value)
+
+    def count(self):
+        """Total number of observations across every label set."""
+        with self._lock:
+            return sum(sum(counts) for counts, _ in self._series.values())
+
+    def samples(self):
+        samples = []
+        with self._lock:
+            for labels, (counts, total) in self._series.items():
+                cumulative = 0
+                for bound, count in zip(self.buckets, counts):
+                    cumulative += count
+                    samples.append(('_bucket', labels + (('le', bound),), cumulative))
+                cumulative += counts[-1]
+                samples.append(('_bucket', labels + (('le', '+Inf'),), cumulative))
+                samples.append(('_sum', labels, total))
+                samples.append(('_count', labels, cumulative))
+        return samples
+
+
+REGISTRY = []
+
+
+def render(registry=None):
+    """Render every registered metric in the Prometheus text format."""
+    metrics = registry if registry is not None else REGISTRY
+    return '\n'.join(metric.render() for metric in metrics) + '\n'
+
+
+INTERACTIONS = Counter('rentduoer_interactions_total', 'Interactions received from Discord, by type.')
+MONGO_LATENCY = Histogram('rentduoer_mongo_operation_seconds', 'MongoDB operation latency, including thread pool wait.')
+MONGO_ERRORS = Counter('rentduoer_mongo_errors_total', 'MongoDB operations that raised, by collection and operation.')
+MESSAGE_EDITS = Counter('rentduoer_discord_message_edits_total', 'Messages edited by the bot, by reason.')
+MESSAGES_SENT = Counter('rentduoer_discord_messages_sent_total', 'Channel messages sent by the bot, by reason.')
+ACTIVE_RENTALS = Gauge('rentduoer_active_rentals', 'Rentals whose countdown is running.')
+SCHEDULED_RENTALS = Gauge('rentduoer_scheduled_rentals', 'Accepted rentals waiting for their start time.')
+GATEWAY_LATENCY = Gauge('rentduoer_gateway_latency_seconds', 'Discord gateway heartbeat latency.')
+LOOP_LAG = Gauge('rentduoer_event_loop_lag_seconds', 'How late the event loop woke up for the last lag probe.')
+OUTBOUND_BACKLOG = Gauge('rentduoer_outbound_backlog', 'Outbound Discord requests waiting for rate budget.')
+OUTBOUND_SHED = Counter('rentduoer_outbound_shed_total', 'Outbound requests dropped under load, by priority class.')
+OUTBOUND_COALESCED = Counter('rentduoer_outbound_coalesced_total', 'Queued message edits superseded by a newer edit.')
+STARTUP_PHASE_SECONDS = Gauge('rentduoer_startup_phase_seconds', 'Time spent in each startup phase of this process.')
+WRITE_BATCH_SIZE = Histogram('rentduoer_mongo_write_batch_size', 'Requests per buffered bulk_write, by collection.',
+                             buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500))
+RENTALS_ARCHIVED = Counter('rentduoer_rentals_archived_total', 'Finished rentals moved to RentalsArchive.')
+BOOKINGS_EXPIRED = Counter('rentduoer_bookings_expired_total', 'Unanswered pending rentals and open requests expired, by kind.')
+DUPLICATES_SUPPRESSED = Counter('rentduoer_duplicates_suppressed_total', 'Redelivered interactions, resubmitted bookings and repeated timer starts ignored, by kind.')
@@ -0,0 +1,206 @@
+import asyncio
+import collections
+import os
+import time
+
+import nextcord
+
+import metrics
+import tracing
+
+# Priority classes, most important first
+USER = 0
+NOTICE = 1
+COSMETIC = 2
+
+PRIORITY_NAMES = {USER: 'user', NOTICE: 'notice', COSMETIC: 'cosmetic'}
+
+# Discord allows roughly 50 requests/second globally and 5 messages per 5 seconds per channel
+GLOBAL_RATE = float(os.getenv('OUTBOUND_GLOBAL_RATE', 45))
+GLOBAL_BURST = float(os.getenv('OUTBOUND_GLOBAL_BURST', 45))
+CHANNEL_RATE = float(os.getenv('OUTBOUND_CHANNEL_RATE', 1))
+CHANNEL_BURST = float(os.getenv('OUTBOUND_CHANNEL_BURST', 5))
+
+# Queued cosmetic edits beyond this are shed, oldest first
+MAX_COSMETIC_BACKLOG = int(os.getenv('OUTBOUND_MAX_COSMETIC_BACKLOG', 100))
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def delay(self, now):
+        """Seconds until a token is available (0 if one is available now)."""
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return 0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+    def is_full(self, now):
+        return self.delay(now) == 0 and self.tokens >= self.capacity
+
+
+class _Outgoing:
+    __slots__ = ('priority', 'channel_id', 'action', 'target', 'kwargs', 'future', 'reason', 'message_id')
+
+    def __init__(self, priority, channel_id, action, target, kwargs, future, reason, message_id=None):
+        self.priority = priority
+        self.channel_id = channel_id
+        self.action = action
+        self.target = target
+        self.kwargs = kwargs
+        self.future = future
+        self.reason = reason
+        self.message_id = message_id
+
+
+class Outbox:
+    """Central queue for outbound channel messages and message edits.
+
+    Requests are dispatched under a global token bucket and one bucket per
+    channel, highest priority class first (user-facing responses, then
+    notices, then cosmetic edits). A queued edit to a message is replaced by
+    any newer edit to the same message, and when the cosmetic backlog grows
+    past ``max_cosmetic_backlog`` the oldest cosmetic edits are dropped.
+
+    :meth:`send` and :meth:`edit` return futures resolving to the sent message
+    (or ``None`` if the request failed or was shed); callers that do not need
+    the result may ignore them.
+    """
+
+    def __init__(self, global_rate=GLOBAL_RATE, global_burst=GLOBAL_BURST,
+                 channel_rate=CHANNEL_RATE, channel_burst=CHANNEL_BURST,
+                 max_cosmetic_backlog=MAX_COSMETIC_BACKLOG):
+        self.global_bucket = TokenBucket(global_rate, global_burst)
+        self.channel_rate = channel_rate
+        self.channel_burst = channel_burst
+        self.max_cosmetic_backlog = max_cosmetic_backlog
+        self._channel_buckets = {}
+        self._queues = {priority: collections.deque() for priority in PRIORITY_NAMES}
+        self._pending_edits = {}
+        self._wakeup = asyncio.Event()
+        self._runner = None
+        self._in_flight = set()
+
+    def send(self, channel, content=None, *, priority=NOTICE, reason='message', **kwargs):
+        future = asyncio.get_running_loop().create_future()
+        self._enqueue(_Outgoing(priority, channel.id, 'send', channel, dict(content=content, **kwargs), future, reason))
+        return future
+
+    def edit(self, message, *, priority=COSMETIC, reason='edit', **kwargs):
+        pending = self._pending_edits.get(message.id)
+        if pending is not None:
+            # Supersede the queued edit; upgrade it if the new one is more important
+            pending.kwargs = kwargs
+            pending.reason = reason
+            if priority < pending.priority:
+                self._queues[pending.priority].remove(pending)
+                pending.priority = priority
+                self._queues[priority].append(pending)
+                self._wakeup.set()
+            metrics.OUTBOUND_COALESCED.inc()
+            return pending.future
+
+        future = asyncio.get_running_loop().create_future()
+        channel_id = getattr(message.channel, 'id', None)
+        item = _Outgoing(priority, channel_id, 'edit', message, kwargs, future, reason, message.id)
+        self._pending_edits[message.id] = item
+        self._enqueue(item)
+        return future
+
+    def backlog(self):
+        return sum(len(queue) for queue in self._queues.values())
+
+    def _enqueue(self, item):
+        self._queues[item.priority].append(item)
+
+        cosmetic = self._queues[COSMETIC]
+        while len(cosmetic) > self.max_cosmetic_backlog:
+            self._shed(cosmetic.popleft())
+
+        if self._runner is None or self._runner.done():
+            self._runner = tracing.detached(asyncio.create_task, self._run())
+        self._wakeup.set()
+
+    def _shed(self, item):
+        if item.message_id is not None:
+            self._pending_edits.pop(item.message_id, None)
+        if not item.future.done():
+            item.future.set_result(None)
+        metrics.OUTBOUND_SHED.inc(priority=PRIORITY_NAMES[item.priority])
+
+    def _channel_bucket(self, channel_id):
+        bucket = self._channel_buckets.get(channel_id)
+        if bucket is None:
+            if len(self._channel_buckets) > 1000:
+                now = time.monotonic()
+                # Idle buckets are full again and carry no state worth keeping
+                self._channel_buckets = {key: value for key, value in self._channel_buckets.items() if not value.is_full(now)}
+            bucket = self._channel_buckets[channel_id] = TokenBucket(self.channel_rate, self.channel_burst)
+        return bucket
+
+    def _next_ready(self, now):
+        """Pop the most important request whose channel has budget, or return how long to wait."""
+        global_wait = self.global_bucket.delay(now)
+        if global_wait:
+            return None, global_wait
+
+        wait = None
+        for priority in sorted(self._queues):
+            queue = self._queues[priority]
+            for item in queue:
+                channel_wait = self._channel_bucket(item.channel_id).delay(now)
+                if channel_wait == 0:
+                    queue.remove(item)
+                    self._channel_bucket(item.channel_id).take()
+                    self.global_bucket.take()
+                    return item, None
+                wait = channel_wait if wait is None else min(wait, channel_wait)
+        return None, wait
+
+    async def _run(self):
+        while True:
+            item, wait = self._next_ready(time.monotonic())
+            if item is not None:
+                if item.message_id is not None:
+                    self._pending_edits.pop(item.message_id, None)
+                task = asyncio.create_task(self._dispatch(item))
+                self._in_flight.add(task)
+                task.add_done_callback(self._in_flight.discard)
+                continue
+
+            # Sleep until a bucket refills or a new request arrives
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), wait)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _dispatch(self, item):
+        try:
+            if item.action == 'send':
+                result = await item.target.send(**item.kwargs)
+                metrics.MESSAGES_SENT.inc(reason=item.reason)
+            else:
+                result = await item.target.edit(**item.kwargs)
+                metrics.MESSAGE_EDITS.inc(reason=item.reason)
+        except nextcord.errors.HTTPException as e:
+            print(f"Error delivering {item.reason} {item.action}: {e}")
+            result = None
+        except Exception as e:
+            # Anything else (a deleted channel object, a bad payload) must still resolve the future
+            print(f"Unexpected error delivering {item.reason} {item.action}: {e!r}")
+            result = None
+        if not item.future.done():
+            item.future.set_result(result)
+
+    async def drain(self, timeout=10):
+        """Wait until every queued request has been delivered, or ``timeout`` passes."""
+        deadline = time.monotonic() + timeout
+        while (self.backlog() or self._in_flight) and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
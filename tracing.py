@@ -0,0 +1,148 @@
+import contextlib
+import contextvars
+import functools
+import json
+import logging
+import os
+import time
+from collections import deque
+
+# Completed spans kept per name for percentile summaries
+TRACE_BUFFER_SIZE = int(os.getenv('TRACE_BUFFER_SIZE', 500))
+
+# Emit one JSON log line per completed span when enabled
+TRACE_LOG_JSON = os.getenv('TRACE_LOG_JSON', '').lower() in ('1', 'true', 'yes')
+
+logger = logging.getLogger('rentduoer.trace')
+if TRACE_LOG_JSON and not logger.handlers:
+    _handler = logging.StreamHandler()
+    _handler.setFormatter(logging.Formatter('%(message)s'))
+    logger.addHandler(_handler)
+    logger.setLevel(logging.INFO)
+
+_current_span = contextvars.ContextVar('current_span', default=None)
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    index = max(0, min(len(sorted_values) - 1, round(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+class Span:
+    def __init__(self, name):
+        self.name = name
+        self.started = time.perf_counter()
+        self.stages = {}
+        self.closed = False
+
+    def add_stage(self, stage, elapsed):
+        # Tasks spawned inside the span inherit it and may outlive it
+        if not self.closed:
+            self.stages[stage] = self.stages.get(stage, 0.0) + elapsed
+
+
+class Tracer:
+    """Records per-callback latency broken down into named stages.
+
+    Each traced callback opens a span; code inside it marks stages such as
+    ``defer``, ``db_read``, ``db_write`` or ``send`` with :meth:`stage`.
+    Completed spans go into a ring buffer per span name, from which
+    :meth:`summary` computes p50/p95/p99 for the total and every stage.
+
+    The current span is carried in a context variable, which tasks copy when
+    they are created; background tasks that outlive a callback should be
+    started through :func:`detached` so their work is not charged to it.
+    """
+
+    def __init__(self, buffer_size=TRACE_BUFFER_SIZE):
+        self.buffer_size = buffer_size
+        self.spans = {}
+
+    @contextlib.contextmanager
+    def span(self, name):
+        span = Span(name)
+        token = _current_span.set(span)
+        error = None
+        try:
+            yield span
+        except BaseException as e:
+            error = type(e).__name__
+            raise
+        finally:
+            _current_span.reset(token)
+            span.closed = True
+            self.record(span, time.perf_counter() - span.started, error)
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        span = _current_span.get()
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            if span is not None:
+                span.add_stage(name, time.perf_counter() - started)
+
+    def traced(self, name):
+        """Decorator running an async callback inside a span called ``name``."""
+        def decorator(func):
+            @functools.wraps(func)
+            async def wrapper(*args, **kwargs):
+                with self.span(name):
+                    return await func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def record(self, span, total, error=None):
+        buffer = self.spans.get(span.name)
+        if buffer is None:
+            buffer = self.spans[span.name] = deque(maxlen=self.buffer_size)
+        buffer.append((total, dict(span.stages), error))
+
+        if TRACE_LOG_JSON:
+            logger.info(json.dumps({
+                'span': span.name,
+                'duration_ms': round(total * 1000, 2),
+                'stages_ms': {stage: round(elapsed * 1000, 2) for stage, elapsed in span.stages.items()},
+                'error': error,
+            }))
+
+    def summary(self):
+        """Return ``{span: {'count', 'errors', 'p50', 'p95', 'p99', 'stages': {...}}}`` in seconds."""
+        result = {}
+        for name, buffer in self.spans.items():
+            records = list(buffer)
+            totals = sorted(total for total, _, _ in records)
+            stage_values = {}
+            for _, stages, _ in records:
+                for stage, elapsed in stages.items():
+                    stage_values.setdefault(stage, []).append(elapsed)
+
+            result[name] = {
+                'count': len(records),
+                'errors': sum(1 for _, _, error in records if error),
+                **self._percentiles(totals),
+                'stages': {stage: self._percentiles(sorted(values)) for stage, values in stage_values.items()},
+            }
+        return result
+
+    @staticmethod
+    def _percentiles(sorted_values):
+        return {
+            'p50': percentile(sorted_values, 0.50),
+            'p95': percentile(sorted_values, 0.95),
+            'p99': percentile(sorted_values, 0.99),
+        }
+
+
+def detached(func, *args, **kwargs):
+    """Call ``func`` in a fresh context, so tasks and callbacks it schedules run outside any span."""
+    return contextvars.Context().run(func, *args, **kwargs)
+
+
+tracer = Tracer()
+traced = tracer.traced
+stage = tracer.stage